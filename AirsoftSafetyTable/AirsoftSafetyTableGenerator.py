@@ -1,7 +1,12 @@
 import numpy as np
+import Instrumentation
 import TableFormatter as tf
+import TableEngine as te
+import TableSink as ts
+import TableCache as tc
 
-def getTable(masses, distances, energiesMuzzle, energiesImpact, classNames, dragCoefficient = 0.477, diameter = 0.006):
+@Instrumentation.stage("getTable")
+def getTable(masses, distances, energiesMuzzle, energiesImpact, classNames, dragCoefficient = None, diameter = None, density = None, sink = None, model = None):
     """
     Parameters
     ----------
@@ -16,9 +21,19 @@ def getTable(masses, distances, energiesMuzzle, energiesImpact, classNames, drag
     classNames: str array
         Names of the different classes (as defined by the distances).
     dragCoefficient: float
-        The drag coefficient. Unit: unitless. Default value: 0.477. 
+        The drag coefficient. Unit: unitless. Default value: 0.477, or that of model.
     diameter: float
-        The projectile diameter, assuming a spherical shape. Unit: m. Default value: 0.006
+        The projectile diameter, assuming a spherical shape. Unit: m. Default value: 0.006, or that of model
+    density: float
+        The air density, see TableSweep.airDensity. Unit: kg/m^3. Default value: 1.225 (15 degC, 1 atm), or that of model
+    sink: TableSink sink
+        Receives the computed table, see TableSink. Default: print the table and
+        write output/latexTable.txt and output/htmlTable.html immediately.
+    model: physics model
+        Optional alternative to the straight line, pure drag model, for
+        instance TrajectoryModel.TrajectoryModel. Default: None
+        The model computes with its own drag coefficient, diameter and
+        density, any of them given here must be the same (else ValueError).
 
     The number of distances, impact energies, muzzle energies and classNames must match!
     """
@@ -28,52 +43,27 @@ def getTable(masses, distances, energiesMuzzle, energiesImpact, classNames, drag
        distances.size != len(classNames):
         print("Number of distances, impact energies, muzzle energies and class names does not match!")
 
-    # ********** Output ***********************************************************
-    muzzleVelocities = np.array(np.ones([distances.size, masses.size])); # m/s
-
-    # ********** Parameters *******************************************************
-    density = 1.225 # kg/m^3 (of the air, 15 degC, 1 atm)
-    #dragCoefficient = 0.477 # unitless
-    #diameter = 0.006 # m (characteristic length i.e. diameter of projectile)
-    area = np.pi * (diameter/2)**2 # m^2
-    
-    constant = 0.5 * dragCoefficient * density * area
-
-    # ********** Energy computation functions *************************************
-    def velocityFromEnergyWithDrag(m, x, E, k):
-        return np.sqrt(2*E/m)*np.exp(k*x/m)
-
-    def velocityFromEnergy(m, E):
-        return np.sqrt(2*E/m)
-
-    def velocityMax(mass, distance, Eimpact, Emax, const):
-        vFromDrag = velocityFromEnergyWithDrag(mass, distance, Eimpact, const)
-        vMuzzleMax = velocityFromEnergy(mass, Emax)
-        return np.min([vFromDrag, vMuzzleMax])
-
-    # ********** Population of the table ******************************************
-    for i_class in range(distances.size):
-        for i_mass in range(masses.size):
-            mass = masses[i_mass]
-            distance = distances[i_class]
-            energyMuzzle = energiesMuzzle[i_class]
-            energyImpact = energiesImpact[i_class]
-            muzzleVelocities[i_class, i_mass] = \
-                velocityMax(mass, distance, energyImpact, energyMuzzle, constant)
-
-    # ********** Print output *****************************************************
-    np.set_printoptions(linewidth=100)
-    print(np.array2string(muzzleVelocities, precision=1))
-
-    tf.formatLatexTable(masses, distances, muzzleVelocities, classNames, "output/latexTable.txt")
+    # ********** Compute the table ************************************************
+    if model is None:
+        result = tc.cachedComputeTable(masses, distances, energiesMuzzle, energiesImpact, classNames, \
+                                       0.477 if dragCoefficient is None else dragCoefficient, \
+                                       0.006 if diameter is None else diameter, \
+                                       1.225 if density is None else density)
+    else:
+        result = te.computeTable(masses, distances, energiesMuzzle, energiesImpact, classNames, dragCoefficient, diameter, density, model = model)
 
-    tf.formatHtmlTable(masses, distances, muzzleVelocities, classNames, "output/htmlTable.html", False)
+    # ********** Output ***********************************************************
+    if sink is None:
+        with ts.FileSink(printTables=True) as fileSink:
+            fileSink.write(result)
+    else:
+        sink.write(result)
 
     # ********** Return the results ***********************************************
-    return masses, distances, muzzleVelocities, constant
+    return result.astuple()
 
-def getVsaf2019Table():
-    # ********** Define table *****************************************************
+def vsaf2019Table():
+    """The hand-made 2019 table: masses (Unit: kg), distances (Unit: m), muzzle velocities (Unit: m/s) and class names."""
     masses = np.array([20, 25, 28, 30, 34, 36, 40, 43, 45])/100000 # kg
     distances = np.array([0, 5, 10, 20, 20, 30, 40]) # m
     muzzleVelocities = np.array([[100.0,  89.4,  84.5,  81.6,  76.7,  74.2,  70.4,  68.0,  66.6],
@@ -84,6 +74,11 @@ def getVsaf2019Table():
                                  [182.9, 163.6, 154.6, 149.3, 140.3, 136.2, 129.2, 124.7, 121.9],
                                  [213.4, 190.8, 180.3, 174.2, 163.6, 159.0, 150.8, 145.5, 142.2]]); # m/s
     classNames = ["CQB\t", "AutoA", "AutoB", "HMG", "Semi", "BoltA", "BoltB"]
+    return masses, distances, muzzleVelocities, classNames
+
+def getVsaf2019Table():
+    # ********** Define table *****************************************************
+    masses, distances, muzzleVelocities, classNames = vsaf2019Table()
     dummyConstant = 0
 
     # ********** Print output *****************************************************
@@ -96,7 +91,45 @@ def getVsaf2019Table():
     # ********** Return the results ***********************************************
     return masses, distances, muzzleVelocities, dummyConstant
 
-def getVsaf2020Table():
+# ********** Rulesets *********************************************************
+# The rulesets are registered by name and only evaluated when asked for, so
+# importing this module computes and writes nothing. A ruleset definition
+# returns the keyword arguments of getTable.
+rulesets = {}
+
+def registerRuleset(name):
+    def register(definition):
+        rulesets[name] = definition
+        return definition
+    return register
+
+def getRuleset(name):
+    """Returns the getTable keyword arguments of a registered ruleset."""
+    if name not in rulesets:
+        raise KeyError("Unknown ruleset {:s}, registered rulesets: {:s}.".format(name, ", ".join(sorted(rulesets))))
+    return rulesets[name]()
+
+def getRulesetTable(name, sink = None, model = None):
+    """getTable for a registered ruleset."""
+    return getTable(sink = sink, model = model, **getRuleset(name))
+
+def computeRulesetTable(name, masses = None):
+    """The SafetyTable of a registered ruleset, without any output, optionally on other masses (Unit: kg)."""
+    ruleset = getRuleset(name)
+    if masses is not None:
+        ruleset["masses"] = masses
+    return tc.cachedComputeTable(**ruleset)
+
+def computeRulesetTables(names):
+    """
+    The SafetyTables of registered rulesets, all computed on the union of
+    their mass axes, so that they can be compared without interpolating.
+    """
+    masses = np.unique(np.concatenate([getRuleset(name)["masses"] for name in names]))
+    return [computeRulesetTable(name, masses) for name in names]
+
+@registerRuleset("vsaf2020")
+def vsaf2020Ruleset():
     masses = np.array([20, 25, 28, 30, 32, 36, 40, 45, 46, 48, 49, 50])/100000 # kg
     #masses = np.array([20, 25, 28, 30, 32, 34, 36, 40, 43, 45, 46, 48, 50, 58])/100000 # kg
     #masses = np.array([20, 25, 28, 30, 34, 36, 40, 43, 45, 48, 50])/100000 # kg
@@ -105,31 +138,43 @@ def getVsaf2020Table():
     energiesMuzzle = np.array([1, 1.34, 1.76, 2.11, 2.51, 3.34, 4.55]) # J (max energy at muzzle)
     energiesImpact = np.array([1, 1, 1, 1.08, 1.16, 1.16, 1.16]) # J (max energy at safety distance)
     classNames = ["CQB\t", "AutoA", "AutoB", "HMG", "Semi", "BoltA", "BoltB"]
-    return getTable(masses, distances, energiesMuzzle, energiesImpact, classNames)
+    return dict(masses = masses, distances = distances, energiesMuzzle = energiesMuzzle, energiesImpact = energiesImpact, classNames = classNames)
 
-def get2020Table():
+@registerRuleset("2020")
+def ruleset2020():
     masses = np.array([20, 25, 28, 30, 34, 36, 40, 43, 45, 48, 50])/100000 # kg
     distances = np.array([0, 5, 10, 20, 20, 30, 40]) # m
     energiesMuzzle = np.array([1.2, 1.45, 1.7, 2.2, 2.2, 3, 4]) # J (max energy at muzzle)
     energiesImpact = np.array([1, 1, 1, 1, 1, 1, 1]) * 1.2 # J (max energy at safety distance)
     classNames = ["CQB 2\t", "Assault 1", "Assault 2", "Support 3", "DMR", "Sniper 1", "Sniper 2"]
-    return getTable(masses, distances, energiesMuzzle, energiesImpact, classNames)
+    return dict(masses = masses, distances = distances, energiesMuzzle = energiesMuzzle, energiesImpact = energiesImpact, classNames = classNames)
 
-def get2020TableDragCoeff04():
-    masses = np.array([20, 25, 28, 30, 34, 36, 40, 43, 45, 48, 50])/100000 # kg
-    distances = np.array([0, 5, 10, 20, 20, 30, 40]) # m
-    energiesMuzzle = np.array([1.2, 1.45, 1.7, 2.2, 2.2, 3, 4]) # J (max energy at muzzle)
-    energiesImpact = np.array([1, 1, 1, 1, 1, 1, 1]) * 1.2 # J (max energy at safety distance)
-    classNames = ["CQB 2\t", "Assault 1", "Assault 2", "Support 3", "DMR", "Sniper 1", "Sniper 2"]
-    return getTable(masses, distances, energiesMuzzle, energiesImpact, classNames, dragCoefficient = 0.4)
+@registerRuleset("2020DragCoeff04")
+def ruleset2020DragCoeff04():
+    ruleset = ruleset2020()
+    ruleset["dragCoefficient"] = 0.4
+    return ruleset
 
-def getVsaf2020FullThrustTable():
-    masses = np.array([58])/100000 # kg
-    distances = np.array([0, 5, 10, 20, 20, 30, 40]) # m
-    energiesMuzzle = np.array([1, 1.34, 1.76, 2.11, 2.51, 3.34, 4.55]) # J (max energy at muzzle)
-    energiesImpact = np.array([1, 1, 1, 1.08, 1.16, 1.16, 1.16]) # J (max energy at safety distance)
-    classNames = ["CQB\t", "AutoA", "AutoB", "HMG", "Semi", "BoltA", "BoltB"]
-    return getTable(masses, distances, energiesMuzzle, energiesImpact, classNames, diameter = 0.00644)
+@registerRuleset("vsaf2020FullThrust")
+def vsaf2020FullThrustRuleset():
+    ruleset = vsaf2020Ruleset()
+    ruleset["masses"] = np.array([58])/100000 # kg
+    ruleset["diameter"] = 0.00644 # m
+    return ruleset
+
+# ********** Ruleset tables ***************************************************
+def getVsaf2020Table(sink = None):
+    return getRulesetTable("vsaf2020", sink)
+
+def get2020Table(sink = None):
+    return getRulesetTable("2020", sink)
+
+def get2020TableDragCoeff04(sink = None):
+    return getRulesetTable("2020DragCoeff04", sink)
+
+def getVsaf2020FullThrustTable(sink = None):
+    return getRulesetTable("vsaf2020FullThrust", sink)
 
-getVsaf2020Table()
-#getVsaf2020FullThrustTable()
\ No newline at end of file
+if __name__ == "__main__":
+    getVsaf2020Table()
+    #getVsaf2020FullThrustTable()
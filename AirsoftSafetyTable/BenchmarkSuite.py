@@ -0,0 +1,206 @@
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import numpy as np
+import AirsoftSafetyTableGenerator
+import DragFit
+import DragFitBenchmark
+import TableArchive
+import TableComparator
+import TableEngine as te
+import TableEngineBenchmark
+import TableFormatter as tf
+
+# ********** Reference outputs ************************************************
+# The TableAnalyzer outputs kept in results_and_documentation, with the two
+# tables (old, new) they compare. Every table is computed again on the mass
+# axis of the file, which is the mass axis of the ruleset when it was written.
+referenceDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "results_and_documentation")
+references = {"Vsaf2019VsVsaf2020.txt": ("vsaf2019", "vsaf2020"), \
+              "2020tabellenVsVsaf2020.txt": ("2020", "vsaf2020"), \
+              "2020tabellenDragCoeff04VsVsaf2020.txt": ("2020DragCoeff04", "vsaf2020"), \
+              "2020tabellenDragCoeff04Vs2020tabellenDragCoeff0477.txt": ("2020DragCoeff04", "2020")}
+
+# The printed precision of every quantity of TableAnalyzer, the tolerance is
+# half of its last digit.
+referencePrecisions = {"Masses": 2, "Distances": 1, \
+                       "MuzzleVelocitiesOld": 1, "MuzzleVelocitiesNew": 1, "MuzzleVelocityDiff": 1, \
+                       "MuzzleEnergyOld": 3, "MuzzleEnergyNew": 3, "MuzzleEnergyDiff": 3, \
+                       "ImpactEnergyOld": 3, "ImpactEnergyNew": 3, "ImpactEnergyDiff": 3}
+
+def parseReference(fileName):
+    """Reads a TableAnalyzer output (name followed by an np.array2string) into a dict of arrays."""
+    with open(fileName, "r") as file:
+        text = file.read()
+    return TableArchive.parseArrayText(text)
+
+def rulesetTable(name, masses):
+    """Masses, distances, muzzle velocities and drag constant of a ruleset on the given mass axis."""
+    if name == "vsaf2019":
+        tableMasses, distances, muzzleVelocities, classNames = AirsoftSafetyTableGenerator.vsaf2019Table()
+        return masses, distances, TableComparator.alignMasses(muzzleVelocities, tableMasses, masses), 0
+    return AirsoftSafetyTableGenerator.computeRulesetTable(name, masses).astuple()
+
+def checkReference(fileName, nameOld, nameNew):
+    """
+    Computes the comparison of a reference file again. Returns a list of
+    (quantity, max absolute error, tolerance) of every quantity in the file.
+    """
+    reference = parseReference(fileName)
+    masses = reference["Masses"] / 1000 # kg
+    massesOld, distancesOld, velocitiesOld, constantOld = rulesetTable(nameOld, masses)
+    massesNew, distancesNew, velocitiesNew, constant = rulesetTable(nameNew, masses)
+    comparison = TableComparator.compareTables(massesOld, distancesOld, velocitiesOld, massesNew, distancesNew, velocitiesNew, constant)
+    computed = {"Masses": comparison.masses * 1000, \
+                "Distances": comparison.distances, \
+                "MuzzleVelocitiesOld": comparison.velocitiesMuzzleA, \
+                "MuzzleVelocitiesNew": comparison.velocitiesMuzzleB, \
+                "MuzzleVelocityDiff": comparison.muzzleVelocityDiff, \
+                "MuzzleEnergyOld": comparison.muzzleEnergiesA, \
+                "MuzzleEnergyNew": comparison.muzzleEnergiesB, \
+                "MuzzleEnergyDiff": comparison.muzzleEnergyDiff, \
+                "ImpactEnergyOld": comparison.impactEnergiesA, \
+                "ImpactEnergyNew": comparison.impactEnergiesB, \
+                "ImpactEnergyDiff": comparison.impactEnergyDiff}
+    results = []
+    for quantity, expected in reference.items():
+        # Interpolated masses tell how the file was made, the tables are
+        # computed again at every mass here.
+        if quantity.startswith("InterpolatedMasses"):
+            continue
+        # A difference of two rounded values is off by up to a full last digit.
+        tolerance = 0.5 * 10.0**-referencePrecisions[quantity] * (2 if quantity.endswith("Diff") else 1) * (1 + 1e-9)
+        if computed[quantity].shape != expected.shape:
+            results.append((quantity, np.inf, tolerance))
+        else:
+            results.append((quantity, float(np.max(np.abs(computed[quantity] - expected))), tolerance))
+    return results
+
+def checkReferences(directory = referenceDirectory):
+    """checkReference for every reference file. Returns (file, quantity, error, tolerance, passed) rows."""
+    rows = []
+    for fileName, (nameOld, nameNew) in references.items():
+        for quantity, error, tolerance in checkReference(os.path.join(directory, fileName), nameOld, nameNew):
+            rows.append((fileName, quantity, error, tolerance, bool(error <= tolerance)))
+    return rows
+
+# ********** Timings **********************************************************
+def timeCases(nClasses, nMasses, repeats = 3):
+    """The best time of every benchmarked function on a synthetic nClasses x nMasses grid. Unit: s"""
+    masses, distances, energiesMuzzle, energiesImpact = TableEngineBenchmark.syntheticRuleset(nClasses, nMasses)
+    classNames = ["Class {:d}".format(i) for i in range(nClasses)]
+    constant = te.dragConstant()
+    bestTime = TableEngineBenchmark.bestTime
+    velocities = te.computeTable(masses, distances, energiesMuzzle, energiesImpact, classNames).muzzleVelocities
+    # A second table with other masses, as the 2020 vs vsaf2020 comparison.
+    massesB = masses * 1.01
+    velocitiesB = te.computeMuzzleVelocities(massesB, distances, energiesMuzzle, energiesImpact, constant)
+    # Drag fit datasets of 9 distances up to 32 m, as measured at the chrono,
+    # as many measurements as cells in the grid.
+    fitDistances, fitVelocities, fitMasses = DragFitBenchmark.syntheticDatasets(max(nClasses * nMasses // 9, 1))
+    if not np.all(np.isfinite(DragFit.fitDragCoefficients(fitDistances, fitVelocities, fitMasses)[0])):
+        raise ValueError("The drag fit of the synthetic datasets of the {:d} x {:d} grid is not finite.".format(nClasses, nMasses))
+    return {"computeTable": bestTime(lambda: te.computeTable(masses, distances, energiesMuzzle, energiesImpact, classNames), repeats), \
+            "impactEnergyFromMuzzleVelocities": bestTime(lambda: TableComparator.impactEnergyFromMuzzleVelocities(velocities, masses, distances, constant), repeats), \
+            "muzzleEnergyFromMuzzleVelocities": bestTime(lambda: TableComparator.muzzleEnergyFromMuzzleVelocities(velocities, masses), repeats), \
+            "compareTables": bestTime(lambda: TableComparator.compareTables(masses, distances, velocities, massesB, distances, velocitiesB, constant), repeats), \
+            "formatLatexTable": bestTime(lambda: tf.formatLatexTable(masses, distances, velocities, classNames, None), repeats), \
+            "formatHtmlTable": bestTime(lambda: tf.formatHtmlTable(masses, distances, velocities, classNames, None), repeats), \
+            "fitDragCoefficients": bestTime(lambda: DragFit.fitDragCoefficients(fitDistances, fitVelocities, fitMasses), repeats)}
+
+def runTimings(gridSizes = [(10, 10), (100, 100), (1000, 1000), (10000, 1000)], repeats = 3, maxRepeatedCells = 10**6):
+    """timeCases on every grid, grids above maxRepeatedCells are timed once. Returns (case, classes, masses, seconds) rows."""
+    rows = []
+    for nClasses, nMasses in gridSizes:
+        times = timeCases(nClasses, nMasses, repeats if nClasses * nMasses <= maxRepeatedCells else 1)
+        for case, seconds in times.items():
+            rows.append((case, nClasses, nMasses, seconds))
+    return rows
+
+# ********** History **********************************************************
+# Every run appends one JSON object per line to the history file, so that
+# runs of different versions and machines can be compared later.
+def gitRevision():
+    """The commit of the working tree, or None outside of git."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), \
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def makeRecord(timings, checks):
+    return {"time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"), \
+            "revision": gitRevision(), \
+            "machine": platform.node(), \
+            "python": platform.python_version(), \
+            "numpy": np.__version__, \
+            "timings": [{"case": case, "classes": nClasses, "masses": nMasses, "seconds": seconds} \
+                        for case, nClasses, nMasses, seconds in timings], \
+            "references": [{"file": fileName, "quantity": quantity, "error": error, "tolerance": tolerance, "passed": passed} \
+                           for fileName, quantity, error, tolerance, passed in checks]}
+
+def readHistory(historyFile):
+    if not os.path.exists(historyFile):
+        return []
+    with open(historyFile, "r") as file:
+        return [json.loads(line) for line in file if line.strip() != ""]
+
+def appendHistory(historyFile, record):
+    directory = os.path.dirname(historyFile)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    with open(historyFile, "a") as file:
+        file.write(json.dumps(record) + "\n")
+
+def findRegressions(history, record, threshold = 1.25):
+    """
+    The timings of record that are more than threshold times slower than the
+    median of the earlier runs on the same machine. Returns (case, classes,
+    masses, seconds, median) rows.
+    """
+    earlier = {}
+    for previous in history:
+        if previous["machine"] != record["machine"]:
+            continue
+        for timing in previous["timings"]:
+            earlier.setdefault((timing["case"], timing["classes"], timing["masses"]), []).append(timing["seconds"])
+    regressions = []
+    for timing in record["timings"]:
+        key = (timing["case"], timing["classes"], timing["masses"])
+        if key in earlier:
+            median = float(np.median(earlier[key]))
+            if timing["seconds"] > threshold * median:
+                regressions.append(key + (timing["seconds"], median))
+    return regressions
+
+# ********** Suite ************************************************************
+def runSuite(historyFile = "output/benchmarkHistory.jsonl", gridSizes = [(10, 10), (100, 100), (1000, 1000), (10000, 1000)], threshold = 1.25):
+    """
+    Checks the reference outputs, times every case, appends the run to the
+    history and reports. Returns True if every reference matches and no case
+    is slower than threshold times its history.
+    """
+    checks = checkReferences()
+    failed = [check for check in checks if not check[4]]
+    print("Reference outputs: {:d} of {:d} quantities within tolerance".format(len(checks) - len(failed), len(checks)))
+    for fileName, quantity, error, tolerance, passed in failed:
+        print("  FAILED {:s} {:s}: max error {:.3g} > {:.3g}".format(fileName, quantity, error, tolerance))
+
+    timings = runTimings(gridSizes)
+    print("{:>34s} {:>7s} {:>7s} {:>12s}".format("case", "classes", "masses", "time [s]"))
+    for case, nClasses, nMasses, seconds in timings:
+        print("{:>34s} {:7d} {:7d} {:12.6f}".format(case, nClasses, nMasses, seconds))
+
+    history = readHistory(historyFile)
+    record = makeRecord(timings, checks)
+    regressions = findRegressions(history, record, threshold)
+    for case, nClasses, nMasses, seconds, median in regressions:
+        print("  SLOWER {:s} {:d}x{:d}: {:.6f} s, median of history {:.6f} s".format(case, nClasses, nMasses, seconds, median))
+    appendHistory(historyFile, record)
+    return len(failed) == 0 and len(regressions) == 0
+
+if __name__ == "__main__":
+    sys.exit(0 if runSuite() else 1)
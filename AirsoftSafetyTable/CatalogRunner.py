@@ -0,0 +1,201 @@
+import concurrent.futures
+import os
+import time
+from multiprocessing import shared_memory
+import numpy as np
+import AirsoftSafetyTableGenerator
+import SafetyTable
+import TableEngine as te
+
+# ********** Catalog layout ***************************************************
+# All rulesets of a catalog are packed into flat shared memory buffers: one
+# for the inputs (masses, distances, energies of every ruleset back to back)
+# and one for the results (the C x M table of every ruleset back to back).
+# A task only names a range of rulesets, the workers read their inputs from
+# and write their tables into shared memory, so no array is pickled.
+
+def _packCatalog(rulesets):
+    """The offsets of every ruleset in the flat input and result buffers."""
+    nMasses = np.array([ruleset["masses"].size for ruleset in rulesets], dtype=np.int64)
+    nClasses = np.array([ruleset["distances"].size for ruleset in rulesets], dtype=np.int64)
+    massOffsets = np.concatenate([[0], np.cumsum(nMasses)])
+    classOffsets = np.concatenate([[0], np.cumsum(nClasses)])
+    tableOffsets = np.concatenate([[0], np.cumsum(nClasses * nMasses)])
+    return massOffsets, classOffsets, tableOffsets
+
+def _sharedArray(shape, dtype = np.float64):
+    """A new shared memory block and an array on it."""
+    memory = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+    return memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+# ********** Workers **********************************************************
+_worker = {}
+
+def _attach(inputName, inputShape, resultName, resultSize, massOffsets, classOffsets, tableOffsets, constants):
+    """Process pool initializer: attaches the shared buffers once per worker."""
+    _worker["input"] = shared_memory.SharedMemory(name=inputName)
+    _worker["result"] = shared_memory.SharedMemory(name=resultName)
+    _worker["inputs"] = np.ndarray(inputShape, dtype=np.float64, buffer=_worker["input"].buf)
+    _worker["results"] = np.ndarray((resultSize,), dtype=np.float64, buffer=_worker["result"].buf)
+    _worker["offsets"] = (massOffsets, classOffsets, tableOffsets)
+    _worker["constants"] = constants
+
+def _computeRange(start, stop):
+    """
+    Computes the tables of rulesets start to stop into the shared result
+    buffer. Returns the worker id, the range, the number of cells and the
+    time spent.
+    """
+    begin = time.perf_counter()
+    inputs, results = _worker["inputs"], _worker["results"]
+    massOffsets, classOffsets, tableOffsets = _worker["offsets"]
+    masses, distances, energiesMuzzle, energiesImpact = inputs
+    for i in range(start, stop):
+        massSlice = slice(massOffsets[i], massOffsets[i + 1])
+        classSlice = slice(classOffsets[i], classOffsets[i + 1])
+        out = results[tableOffsets[i]:tableOffsets[i + 1]].reshape(classOffsets[i + 1] - classOffsets[i], massOffsets[i + 1] - massOffsets[i])
+        te.computeMuzzleVelocities(masses[massSlice], distances[classSlice], energiesMuzzle[classSlice], energiesImpact[classSlice], \
+                                   _worker["constants"][i], out=out)
+    return os.getpid(), start, stop, int(tableOffsets[stop] - tableOffsets[start]), time.perf_counter() - begin
+
+def _splitTasks(tableOffsets, maxTaskCells, minTasks):
+    """Ranges of whole rulesets of at most maxTaskCells cells, at least minTasks of them when possible."""
+    nRulesets = tableOffsets.size - 1
+    cells = int(tableOffsets[-1])
+    taskCells = max(1, min(maxTaskCells, -(-cells // max(1, minTasks))))
+    tasks = []
+    start = 0
+    while start < nRulesets:
+        stop = int(np.searchsorted(tableOffsets, tableOffsets[start] + taskCells, side="right")) - 1
+        stop = min(max(stop, start + 1), nRulesets)
+        tasks.append((start, stop))
+        start = stop
+    return tasks
+
+# ********** Runner ***********************************************************
+def runCatalog(catalog, \
+               dragCoefficient = None, \
+               diameter = None, \
+               density = None, \
+               processes = 1, \
+               maxTaskCells = 2**20, \
+               progress = None):
+    """
+    Computes the table of every ruleset of a catalog, spread over a process
+    pool that writes into one shared memory result buffer.
+
+    Parameters
+    ----------
+    catalog : list of dict or str
+        The rulesets, as keyword arguments of getTable or as names of
+        registered rulesets (see AirsoftSafetyTableGenerator.getRuleset).
+    dragCoefficient, diameter, density : float
+        Optional physical constants that replace those of every ruleset, to
+        regenerate the whole catalog when they change.
+    processes : int
+        Number of worker processes. 1 computes everything in the calling
+        process, the same way.
+    maxTaskCells : int
+        Upper bound on the number of table cells of one task. The catalog is
+        split in at least four tasks per worker for load balancing.
+    progress : function
+        Optional progress(rulesetsDone, rulesets, cellsDone, cells), called
+        after every task.
+
+    Returns the SafetyTable of every ruleset and the timing of every worker
+    as a dict {worker id: {"tasks", "rulesets", "cells", "seconds"}}. The
+    tables are views of one read-only buffer.
+    """
+    rulesets = []
+    for ruleset in catalog:
+        ruleset = AirsoftSafetyTableGenerator.getRuleset(ruleset) if isinstance(ruleset, str) else dict(ruleset)
+        for name, value in [("dragCoefficient", dragCoefficient), ("diameter", diameter), ("density", density)]:
+            if value is not None:
+                ruleset[name] = value
+        if ruleset["distances"].size != len(ruleset["classNames"]):
+            raise ValueError("Missmatch between class names ({:d}) and distances ({:d}).".format(len(ruleset["classNames"]), ruleset["distances"].size))
+        rulesets.append(ruleset)
+    constants = np.array([te.dragConstant(ruleset.get("dragCoefficient", 0.477), ruleset.get("diameter", 0.006), ruleset.get("density", 1.225)) \
+                          for ruleset in rulesets], dtype=np.float64)
+    massOffsets, classOffsets, tableOffsets = _packCatalog(rulesets)
+    inputShape = (4, max(int(massOffsets[-1]), int(classOffsets[-1])))
+    resultSize = int(tableOffsets[-1])
+    tasks = _splitTasks(tableOffsets, maxTaskCells, 4 * max(1, processes))
+
+    inputMemory, inputs = _sharedArray(inputShape)
+    resultMemory, results = _sharedArray((resultSize,))
+    workers = {}
+    try:
+        for i, ruleset in enumerate(rulesets):
+            inputs[0, massOffsets[i]:massOffsets[i + 1]] = ruleset["masses"]
+            for row, name in [(1, "distances"), (2, "energiesMuzzle"), (3, "energiesImpact")]:
+                inputs[row, classOffsets[i]:classOffsets[i + 1]] = ruleset[name]
+        attachArguments = (inputMemory.name, inputShape, resultMemory.name, resultSize, massOffsets, classOffsets, tableOffsets, constants)
+
+        done = [0, 0]
+        def collect(worker, start, stop, cells, seconds):
+            timing = workers.setdefault(worker, {"tasks": 0, "rulesets": 0, "cells": 0, "seconds": 0.0})
+            timing["tasks"] += 1
+            timing["rulesets"] += stop - start
+            timing["cells"] += cells
+            timing["seconds"] += seconds
+            done[0] += stop - start
+            done[1] += cells
+            if progress is not None:
+                progress(done[0], len(rulesets), done[1], resultSize)
+
+        if processes <= 1:
+            _attach(*attachArguments)
+            try:
+                for start, stop in tasks:
+                    collect(*_computeRange(start, stop))
+            finally:
+                _worker["input"].close()
+                _worker["result"].close()
+                _worker.clear()
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=_attach, initargs=attachArguments) as executor:
+                futures = [executor.submit(_computeRange, start, stop) for start, stop in tasks]
+                for future in concurrent.futures.as_completed(futures):
+                    collect(*future.result())
+        # One copy out of shared memory, which is released below.
+        table = np.array(results)
+    finally:
+        del inputs, results
+        for memory in [inputMemory, resultMemory]:
+            memory.close()
+            memory.unlink()
+
+    table.flags.writeable = False
+    tables = []
+    for i, ruleset in enumerate(rulesets):
+        muzzleVelocities = table[tableOffsets[i]:tableOffsets[i + 1]].reshape(ruleset["distances"].size, ruleset["masses"].size)
+        tables.append(SafetyTable.SafetyTable(ruleset["masses"], ruleset["distances"], ruleset["energiesMuzzle"], ruleset["energiesImpact"], \
+                                              ruleset["classNames"], muzzleVelocities, constants[i]))
+    return tables, workers
+
+# ********** Synthetic catalog ************************************************
+def syntheticCatalog(nRulesets, nMasses = 12, seed = 0):
+    """nRulesets random national and club rulesets of 4 to 10 classes, for benchmarking."""
+    rng = np.random.default_rng(seed)
+    catalog = []
+    for i in range(nRulesets):
+        nClasses = int(rng.integers(4, 11))
+        energiesMuzzle = np.sort(rng.uniform(0.9, 4.6, nClasses)) # J
+        catalog.append(dict(masses = np.linspace(20, 50, nMasses)/100000, # kg
+                            distances = np.sort(rng.choice([0, 5, 10, 15, 20, 30, 40, 50], nClasses)).astype(np.float64), # m
+                            energiesMuzzle = energiesMuzzle,
+                            energiesImpact = np.minimum(energiesMuzzle, rng.uniform(0.9, 1.2, nClasses)), # J
+                            classNames = ["Class {:d}".format(i_class) for i_class in range(nClasses)]))
+    return catalog
+
+if __name__ == "__main__":
+    catalog = syntheticCatalog(500, nMasses = 1000)
+    def report(rulesetsDone, rulesets, cellsDone, cells):
+        print("\r{:5d}/{:d} rulesets, {:5.1f}%".format(rulesetsDone, rulesets, 100 * cellsDone / cells), end="", flush=True)
+    for processes in sorted(set([1, os.cpu_count()])):
+        start = time.perf_counter()
+        tables, workers = runCatalog(catalog, processes = processes, progress = report)
+        print("\n{:d} processes: {:.3f} s".format(processes, time.perf_counter() - start))
+        for worker, timing in sorted(workers.items()):
+            print("  worker {:d}: {:d} tasks, {:d} rulesets, {:d} cells, {:.3f} s".format(worker, timing["tasks"], timing["rulesets"], timing["cells"], timing["seconds"]))
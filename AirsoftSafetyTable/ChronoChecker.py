@@ -0,0 +1,168 @@
+import collections
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import TableComparator
+import TableQuery
+
+# ********** Log format *******************************************************
+# A chrono log has one row per shot. The column names can be mapped with the
+# columns argument, the BB mass is given in grams.
+defaultColumns = {"gun": "gun", "mass": "mass", "velocity": "velocity", "class": "class"}
+
+def readLog(fileName, chunkSize = 2**20, columns = defaultColumns):
+    """Yields the shots of a CSV or Parquet chrono log as DataFrames of at most chunkSize rows."""
+    usecols = [columns[name] for name in ["gun", "mass", "velocity", "class"]]
+    if fileName.endswith(".parquet"):
+        import pyarrow.parquet
+        for batch in pyarrow.parquet.ParquetFile(fileName).iter_batches(batch_size=chunkSize, columns=usecols):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(fileName, chunksize=chunkSize, usecols=usecols, \
+                                 dtype={columns["gun"]: str, columns["class"]: str, columns["mass"]: np.float64, columns["velocity"]: np.float64}):
+            yield chunk
+
+# ********** Compliance *******************************************************
+def checkShots(query, classNames, masses, velocities):
+    """
+    Checks shots against a ruleset.
+
+    Parameters
+    ----------
+    query : TableQuery.SafetyQuery
+        The compiled ruleset.
+    classNames : np.array
+        Declared class of every shot. Unknown classes fail.
+    masses : np.array
+        BB masses. Unit: kg
+    velocities : np.array
+        Measured muzzle velocities. Unit: m/s
+
+    Returns a dict of arrays: the allowed muzzle velocity (m/s), the muzzle
+    and impact energies (J), the margin allowed - measured (m/s) and passed.
+    """
+    rows = query.classIndices(classNames, missing=-1)
+    known = rows >= 0
+    rows = np.where(known, rows, 0)
+    masses = np.asarray(masses, dtype=np.float64)
+    velocities = np.asarray(velocities, dtype=np.float64)
+    allowed = query.maxVelocities(rows, masses)
+    allowed[~known] = np.nan
+    energiesMuzzle = masses*velocities*velocities*0.5
+    energiesImpact = TableComparator.impactEnergyFromMuzzleVelocity(masses, query.distances[rows], velocities, query.constant)
+    energiesImpact[~known] = np.nan
+    margin = allowed - velocities
+    return {"allowedVelocity": allowed, "muzzleEnergy": energiesMuzzle, "impactEnergy": energiesImpact, \
+            "margin": margin, "passed": margin >= 0}
+
+def _checkChunk(query, chunk, columns, massScale, formatShots):
+    result = checkShots(query, chunk[columns["class"]].to_numpy(), chunk[columns["mass"]].to_numpy() * massScale, chunk[columns["velocity"]].to_numpy())
+    shots = pd.DataFrame(result, index=chunk.index)
+    shots.insert(0, "class", chunk[columns["class"]].to_numpy())
+    shots.insert(0, "gun", chunk[columns["gun"]].to_numpy())
+    shots["failed"] = ~shots["passed"]
+    summaries = {}
+    for key in ["class", "gun"]:
+        summaries[key] = shots.groupby(key, sort=False).agg(shots=("passed", "size"), \
+                                                            failures=("failed", "sum"), \
+                                                            marginSum=("margin", "sum"), \
+                                                            marginCount=("margin", "count"), \
+                                                            minMargin=("margin", "min"), \
+                                                            maxMuzzleEnergy=("muzzleEnergy", "max"), \
+                                                            maxImpactEnergy=("impactEnergy", "max"))
+    # The shots are formatted in the worker, which is the expensive part of
+    # writing the results file.
+    shotsText = shots.drop(columns="failed").to_csv(header=False, index=False) if formatShots else None
+    return shotsText, summaries
+
+def _mergeSummaries(total, summary):
+    if total is None:
+        return summary
+    return pd.concat([total, summary]).groupby(level=0, sort=False).agg({"shots": "sum", "failures": "sum", \
+                                                                        "marginSum": "sum", "marginCount": "sum", "minMargin": "min", \
+                                                                        "maxMuzzleEnergy": "max", "maxImpactEnergy": "max"})
+
+def checkLog(fileName, \
+             ruleset = "vsaf2020", \
+             resultsFile = None, \
+             reportFile = None, \
+             chunkSize = 2**20, \
+             processes = 1, \
+             columns = defaultColumns, \
+             massScale = 0.001):
+    """
+    Checks every shot of a chrono log in chunks, so the memory use does not
+    depend on the length of the log.
+
+    Parameters
+    ----------
+    fileName : str
+        The chrono log, CSV or Parquet (see readLog).
+    ruleset : str, dict or TableQuery.SafetyQuery
+        The ruleset to check against, see SafetyQuery.fromRuleset.
+    resultsFile : str
+        Optional CSV receiving every shot with its allowed velocity, energies,
+        margin and pass/fail, in log order.
+    reportFile : str
+        Optional text file receiving the summary report, see formatReport.
+    chunkSize : int
+        Number of shots per chunk.
+    processes : int
+        Number of worker processes. At most two chunks per worker are in
+        flight at any time.
+    columns : dict
+        Column names of the log, see defaultColumns.
+    massScale : float
+        Converts the mass column to kg. Default: grams.
+
+    Returns the summaries per class and per gun as DataFrames.
+    """
+    query = ruleset if isinstance(ruleset, TableQuery.SafetyQuery) else TableQuery.SafetyQuery.fromRuleset(ruleset)
+    totals = {"class": None, "gun": None}
+    results = None
+    if resultsFile is not None:
+        results = open(resultsFile, "w")
+        results.write("gun,class,allowedVelocity,muzzleEnergy,impactEnergy,margin,passed\n")
+
+    def collect(shotsText, summaries):
+        for key in totals:
+            totals[key] = _mergeSummaries(totals[key], summaries[key])
+        if results is not None:
+            results.write(shotsText)
+
+    if processes <= 1:
+        for chunk in readLog(fileName, chunkSize, columns):
+            collect(*_checkChunk(query, chunk, columns, massScale, results is not None))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            pending = collections.deque()
+            for chunk in readLog(fileName, chunkSize, columns):
+                pending.append(executor.submit(_checkChunk, query, chunk, columns, massScale, results is not None))
+                if len(pending) >= 2*processes:
+                    collect(*pending.popleft().result())
+            while len(pending) > 0:
+                collect(*pending.popleft().result())
+
+    if results is not None:
+        results.close()
+    for key in totals:
+        if totals[key] is not None:
+            totals[key]["meanMargin"] = totals[key]["marginSum"] / totals[key]["marginCount"]
+            totals[key] = totals[key].drop(columns=["marginSum", "marginCount"])
+    if reportFile is not None:
+        file = open(reportFile, "w")
+        file.write(formatReport(totals["class"], totals["gun"]))
+        file.close()
+    return totals["class"], totals["gun"]
+
+# ********** Report ***********************************************************
+def formatReport(classSummary, gunSummary):
+    """The summaries of checkLog as a text report, failing guns first."""
+    if classSummary is None:
+        return "No shots.\n"
+    report = "Shots: {:d}, failures: {:d}\n\n".format(int(classSummary["shots"].sum()), int(classSummary["failures"].sum()))
+    report += "Per class\n" + classSummary.to_string(float_format="{:.2f}".format) + "\n\n"
+    failing = gunSummary[gunSummary["failures"] > 0].sort_values("minMargin")
+    report += "Guns with failures ({:d} of {:d})\n".format(len(failing), len(gunSummary))
+    report += (failing.to_string(float_format="{:.2f}".format) if len(failing) > 0 else "None") + "\n"
+    return report
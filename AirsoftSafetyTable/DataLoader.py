@@ -0,0 +1,127 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# ********** Dataset files ****************************************************
+# A dataset file holds the measurements of one gun with one BB weight:
+#
+#   SSG24                                      <- gun name
+#   0.45                                       <- BB weight, Unit: g
+#   Distance,Value_1,Value_2,...               <- distance (m), shot velocities (m/s)
+#   0,114,113,114,114,113
+#   ...
+
+def parseDataset(fileName):
+    """
+    Reads a dataset file. Returns the gun name, the BB weight (Unit: kg) and
+    the distance, shot number and velocity of every shot as arrays.
+    """
+    with open(fileName, "r") as file:
+        gun = file.readline().strip()
+        weight = float(file.readline().strip()) / 1000 # kg
+        frame = pd.read_csv(file)
+    distances = frame["Distance"].to_numpy(dtype=np.float64)
+    values = frame[[column for column in frame.columns if column.startswith("Value_")]].to_numpy(dtype=np.float64)
+    shots = np.tile(np.arange(1, values.shape[1] + 1, dtype=np.int16), values.shape[0])
+    velocities = values.reshape(-1)
+    keep = ~np.isnan(velocities)
+    return gun, weight, np.repeat(distances, values.shape[1])[keep], shots[keep], velocities[keep]
+
+def discoverDatasets(directory = "data"):
+    """All dataset files (*.csv) of a directory, sorted by name."""
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith(".csv"))
+
+# ********** Loading with cache ***********************************************
+def _fileStamp(fileName):
+    stat = os.stat(fileName)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def _readCache(cacheFile):
+    if cacheFile is None or not os.path.exists(cacheFile):
+        return {}
+    try:
+        with np.load(cacheFile, allow_pickle=False) as cache:
+            manifest = json.loads(str(cache["manifest"]))
+            columns = [cache[name] for name in ["distance", "shot", "velocity"]]
+    except (OSError, ValueError, KeyError):
+        return {}
+    entries = {}
+    offset = 0
+    for entry in manifest:
+        rows = slice(offset, offset + entry["rows"])
+        entries[entry["file"]] = (entry,) + tuple(column[rows] for column in columns)
+        offset += entry["rows"]
+    return entries
+
+def _writeCache(cacheFile, entries):
+    directory = os.path.dirname(cacheFile)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    manifest = [dict(entry, rows=len(velocities)) for entry, distances, shots, velocities in entries]
+    temporary = cacheFile + ".{:d}.tmp".format(os.getpid())
+    with open(temporary, "wb") as file:
+        np.savez(file, \
+                 manifest=np.array(json.dumps(manifest)), \
+                 distance=np.concatenate([distances for entry, distances, shots, velocities in entries]), \
+                 shot=np.concatenate([shots for entry, distances, shots, velocities in entries]), \
+                 velocity=np.concatenate([velocities for entry, distances, shots, velocities in entries]))
+    os.replace(temporary, cacheFile)
+
+def loadDatasets(directory = "data", cacheFile = "output/datasetCache.npz"):
+    """
+    Loads every dataset file of a directory into one long-format table with
+    one row per shot and the columns
+
+        set      : category, file name without extension
+        gun      : category, gun name from the file header
+        weight   : float64, BB weight from the file header. Unit: kg
+        distance : float64. Unit: m
+        shot     : int16, shot number at the distance (Value_n)
+        velocity : float64. Unit: m/s
+
+    The parsed files are cached in cacheFile (None disables the cache)
+    together with a manifest of their modification times and sizes. Only
+    files that are new or have changed since are parsed again.
+    """
+    cached = _readCache(cacheFile)
+    entries = []
+    changed = False
+    for fileName in discoverDatasets(directory):
+        name = os.path.basename(fileName)
+        stamp = _fileStamp(fileName)
+        if name in cached and cached[name][0]["stamp"] == stamp:
+            entries.append(cached[name])
+        else:
+            gun, weight, distances, shots, velocities = parseDataset(fileName)
+            entry = {"file": name, "stamp": stamp, "set": os.path.splitext(name)[0], "gun": gun, "weight": weight}
+            entries.append((entry, distances, shots, velocities))
+            changed = True
+    if cacheFile is not None and (changed or len(entries) != len(cached)) and len(entries) > 0:
+        _writeCache(cacheFile, entries)
+
+    counts = [len(velocities) for entry, distances, shots, velocities in entries]
+    def perShot(key):
+        return np.repeat([entry[key] for entry, distances, shots, velocities in entries], counts)
+    if len(entries) == 0:
+        return pd.DataFrame({"set": pd.Categorical([]), "gun": pd.Categorical([]), "weight": np.zeros(0), \
+                             "distance": np.zeros(0), "shot": np.zeros(0, dtype=np.int16), "velocity": np.zeros(0)})
+    return pd.DataFrame({"set": pd.Categorical(perShot("set"), categories=[entry["set"] for entry, distances, shots, velocities in entries]), \
+                         "gun": pd.Categorical(perShot("gun")), \
+                         "weight": perShot("weight").astype(np.float64), \
+                         "distance": np.concatenate([distances for entry, distances, shots, velocities in entries]), \
+                         "shot": np.concatenate([shots for entry, distances, shots, velocities in entries]), \
+                         "velocity": np.concatenate([velocities for entry, distances, shots, velocities in entries])})
+
+def meanVelocities(measurements):
+    """
+    The mean velocity per set and distance of a loadDatasets table.
+    Returns the set names, their weights (Unit: kg) and lists of the distances
+    (Unit: m) and mean velocities (Unit: m/s) of every set, as DragFit takes them.
+    """
+    means = measurements.groupby(["set", "distance"], observed=True, sort=True)["velocity"].mean()
+    sets = [name for name in measurements["set"].cat.categories if name in means.index.get_level_values(0)]
+    weights = measurements.groupby("set", observed=True)["weight"].first()[sets].to_numpy()
+    distances = [means[name].index.to_numpy() for name in sets]
+    velocities = [means[name].to_numpy() for name in sets]
+    return sets, weights, distances, velocities
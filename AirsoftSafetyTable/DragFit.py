@@ -0,0 +1,141 @@
+import numpy as np
+import Instrumentation
+
+# ********** Datasets *********************************************************
+def padDatasets(arrays):
+    """
+    Stacks 1D arrays of different lengths into one 2D array, one dataset per
+    row, padded with NaN. Every fit function takes either such a 2D array or
+    a list of 1D arrays.
+    """
+    if isinstance(arrays, np.ndarray) and arrays.ndim == 2:
+        return arrays.astype(np.float64)
+    length = max(len(array) for array in arrays)
+    padded = np.full((len(arrays), length), np.nan)
+    for i, array in enumerate(arrays):
+        padded[i, :len(array)] = array
+    return padded
+
+def decayRates(masses, density = 1.184, diameter = 0.006):
+    """
+    The exponential decay rate per unit drag coefficient, 0.5*rho*A/m, of
+    v(x) = v0*exp(-c*0.5*rho*A/m*x) for every dataset. Unit: 1/m
+    """
+    area = np.pi * (diameter/2)**2 # m^2
+    return 0.5 * density * area / np.asarray(masses, dtype=np.float64)
+
+# ********** Model ************************************************************
+def modelVelocities(distances, initialVelocities, masses, dragCoefficient, density = 1.184, diameter = 0.006):
+    """
+    The exponential decay model of every dataset (rows) at distances.
+    initialVelocities is the measured velocity at distance 0 of every dataset.
+    """
+    rates = decayRates(masses, density, diameter).reshape(-1, 1)
+    initialVelocities = np.asarray(initialVelocities, dtype=np.float64).reshape(-1, 1)
+    dragCoefficient = np.asarray(dragCoefficient, dtype=np.float64)
+    if dragCoefficient.ndim == 1:
+        dragCoefficient = dragCoefficient.reshape(-1, 1)
+    return initialVelocities * np.exp(-dragCoefficient * rates * padDatasets(distances))
+
+def modelError(distances, velocities, masses, dragCoefficient, density = 1.184, diameter = 0.006):
+    """Root mean square error of the model over all measurements of all datasets. Unit: m/s"""
+    velocities = padDatasets(velocities)
+    prediction = modelVelocities(distances, velocities[:, 0], masses, dragCoefficient, density, diameter)
+    return np.sqrt(np.nanmean((velocities - prediction)**2))
+
+# ********** Fitting **********************************************************
+@Instrumentation.stage("dragFit")
+def fitDragCoefficients(distances, \
+                        velocities, \
+                        masses, \
+                        density = 1.184, \
+                        diameter = 0.006, \
+                        method = "leastSquares", \
+                        maxIterations = 50, \
+                        tolerance = 1e-12):
+    """
+    Fits one drag coefficient per dataset to v(x) = v0*exp(-c*0.5*rho*A/m*x),
+    with v0 the first measurement of the dataset, all datasets at once.
+
+    Parameters
+    ----------
+    distances : list of np.array or 2D np.array
+        Distances of the measurements of every dataset. Unit: m
+    velocities : list of np.array or 2D np.array
+        Mean measured velocities of every dataset. The first one must be at
+        distance 0. Unit: m/s
+    masses : np.array
+        The BB mass of every dataset. Unit: kg
+    density : float
+        The air density. Unit: kg/m^3
+    diameter : float
+        The BB diameter. Unit: m
+    method : str
+        "leastSquares" minimizes the squared velocity residuals like
+        scipy.optimize.curve_fit, with Gauss-Newton iterations that run on
+        all datasets together, started from the log-linear solution of the
+        positive velocities.
+        "logLinear" is the closed-form least squares fit of log(v/v0).
+
+    Returns the drag coefficients, their variances (the pcov of curve_fit)
+    and the number of iterations.
+    """
+    x = padDatasets(distances)
+    v = padDatasets(velocities)
+    valid = ~(np.isnan(x) | np.isnan(v))
+    x = np.where(valid, x, 0)
+    v = np.where(valid, v, 0)
+    v0 = v[:, :1]
+    rates = decayRates(masses, density, diameter).reshape(-1, 1)
+    ax = rates * x
+    degreesOfFreedom = valid.sum(axis=1) - 1
+
+    # Closed form: log(v/v0) = -c*a*x is linear in c. Only positive velocities
+    # have a logarithm, datasets without any to fit start from 0.5 like
+    # curve_fit.
+    positive = valid & (v > 0) & (v0 > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        logRatio = np.where(positive, np.log(v / v0), 0)
+        dragCoefficients = -np.sum(ax * logRatio, axis=1) / np.sum(np.where(positive, ax * ax, 0), axis=1)
+    dragCoefficients = np.where(np.isfinite(dragCoefficients), dragCoefficients, 0.5)
+
+    iterations = 0
+    if method == "leastSquares":
+        for iterations in range(1, maxIterations + 1):
+            prediction = v0 * np.exp(-dragCoefficients[:, np.newaxis] * ax)
+            jacobian = np.where(valid, -ax * prediction, 0)
+            residuals = np.where(valid, v - prediction, 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                step = np.sum(jacobian * residuals, axis=1) / np.sum(jacobian * jacobian, axis=1)
+            dragCoefficients = dragCoefficients + step
+            # Datasets that cannot be fitted (NaN) do not hold up the others.
+            converged = (np.abs(step) <= tolerance * np.abs(dragCoefficients)) | ~np.isfinite(dragCoefficients)
+            if np.all(converged):
+                break
+    elif method != "logLinear":
+        raise ValueError("Unknown method {:s}, use leastSquares or logLinear.".format(method))
+
+    # Variance as curve_fit: inv(J^T J) * sum(r^2)/(n - 1).
+    prediction = v0 * np.exp(-dragCoefficients[:, np.newaxis] * ax)
+    jacobian = np.where(valid, -ax * prediction, 0)
+    residuals = np.where(valid, v - prediction, 0)
+    variances = np.sum(residuals * residuals, axis=1) / degreesOfFreedom / np.sum(jacobian * jacobian, axis=1)
+    if Instrumentation.enabled:
+        Instrumentation.count("fitIterations", iterations)
+        Instrumentation.count("fittedDatasets", dragCoefficients.size)
+    return dragCoefficients, variances, iterations
+
+def combineDragCoefficients(dragCoefficients, variances):
+    """
+    Combines the drag coefficients of the datasets to one value with more
+    evidence. The combined distributions mean is the average of means weighed
+    by precision and the combined variance is the harmonic sum of variances.
+    ref: https://stats.stackexchange.com/questions/193987/how-to-combine-two-measurements-of-the-same-quantity-with-different-confidences
+
+    Returns the combined mean and variance.
+    """
+    dragCoefficients = np.asarray(dragCoefficients)
+    weights = 1 / np.asarray(variances)**2
+    variance = 1 / np.sum(weights)
+    mean = np.sum(dragCoefficients * weights) * variance
+    return mean, variance
@@ -0,0 +1,53 @@
+import time
+import numpy as np
+import scipy.optimize as sp
+import DragFit
+
+# ********** Reference implementation *****************************************
+def curveFitDragCoefficients(distances, velocities, masses, density = 1.184, diameter = 0.006):
+    """One scipy.optimize.curve_fit per dataset, as dataAnalyzer used to fit."""
+    rates = DragFit.decayRates(masses, density, diameter)
+    dragCoefficients = []
+    pcovs = []
+    for x, v, rate in zip(distances, velocities, rates):
+        popt, pcov = sp.curve_fit(lambda x, c: v[0] * np.exp(- c * rate * x), x, v, 0.5)
+        dragCoefficients.append(popt[0])
+        pcovs.append(pcov[0][0])
+    return np.array(dragCoefficients), np.array(pcovs)
+
+def syntheticDatasets(nSets, nDistances = 9, seed = 0, maxDistance = 32):
+    """
+    Chrono measurements of nSets guns at nDistances distances from 0 to
+    maxDistance (Unit: m), every 4 m by default, with 1 m/s noise.
+    """
+    rng = np.random.default_rng(seed)
+    masses = rng.choice([20, 25, 28, 30, 36, 40, 45], nSets)/100000 # kg
+    initialVelocities = rng.uniform(60, 130, nSets) # m/s
+    dragCoefficients = rng.normal(0.477, 0.02, nSets)
+    distances = np.tile(np.linspace(0, maxDistance, nDistances), (nSets, 1)) # m
+    velocities = DragFit.modelVelocities(distances, initialVelocities, masses, dragCoefficients)
+    velocities[:, 1:] += rng.normal(0, 1, (nSets, nDistances - 1))
+    return distances, velocities, masses
+
+# ********** Benchmark ********************************************************
+def runBenchmark(setCounts = [5, 100, 1000, 10000], maxCurveFitSets = 1000):
+    print("{:>7s} {:>14s} {:>14s} {:>14s} {:>9s} {:>12s}".format("sets", "curve_fit [s]", "vectorized [s]", "loglinear [s]", "speedup", "max |dc|"))
+    for nSets in setCounts:
+        distances, velocities, masses = syntheticDatasets(nSets)
+        start = time.perf_counter()
+        dragCoefficients, variances, iterations = DragFit.fitDragCoefficients(distances, velocities, masses)
+        timeVectorized = time.perf_counter() - start
+        start = time.perf_counter()
+        DragFit.fitDragCoefficients(distances, velocities, masses, method="logLinear")
+        timeLogLinear = time.perf_counter() - start
+        if nSets <= maxCurveFitSets:
+            start = time.perf_counter()
+            reference, referenceVariances = curveFitDragCoefficients(distances, velocities, masses)
+            timeCurveFit = time.perf_counter() - start
+            print("{:7d} {:14.6f} {:14.6f} {:14.6f} {:8.0f}x {:12.2e}".format(nSets, timeCurveFit, timeVectorized, timeLogLinear, \
+                  timeCurveFit / timeVectorized, np.max(np.abs(reference - dragCoefficients))))
+        else:
+            print("{:7d} {:>14s} {:14.6f} {:14.6f} {:>9s} {:>12s}".format(nSets, "-", timeVectorized, timeLogLinear, "-", "-"))
+
+if __name__ == "__main__":
+    runBenchmark()
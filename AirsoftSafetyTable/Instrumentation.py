@@ -0,0 +1,173 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+# ********** Configuration ****************************************************
+# Everything is configured by environment variables, read once at import:
+#
+#   AIRSOFT_INSTRUMENT=1                Collect stage timers and counters.
+#   AIRSOFT_INSTRUMENT_FILE=<file>      Export them at exit, Prometheus text
+#                                       if the file ends in .prom, else JSON.
+#   AIRSOFT_PROFILE=cprofile            Profile the whole run with cProfile, or
+#   AIRSOFT_PROFILE=tracemalloc         trace the memory allocations.
+#   AIRSOFT_PROFILE_FILE=<file>         Where the profile goes at exit.
+#
+# When AIRSOFT_INSTRUMENT is not set, stage() returns the functions unchanged
+# and the counters are guarded by the enabled flag at the call sites, so the
+# instrumented code runs exactly as it would without instrumentation.
+
+enabled = os.environ.get("AIRSOFT_INSTRUMENT", "") not in ["", "0"]
+profileMode = os.environ.get("AIRSOFT_PROFILE", "")
+
+timers = {} # stage -> [calls, seconds]
+counters = {} # name -> value
+lock = threading.Lock()
+
+# ********** Timers and counters **********************************************
+def addTime(name, seconds):
+    with lock:
+        timer = timers.setdefault(name, [0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+
+def count(name, value = 1):
+    """Adds value to a counter. Call sites guard it with Instrumentation.enabled."""
+    with lock:
+        counters[name] = counters.get(name, 0) + value
+
+def stage(name):
+    """Decorator timing every call of a function as stage name, when enabled."""
+    def decorate(function):
+        if not enabled:
+            return function
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                addTime(name, time.perf_counter() - start)
+        return timed
+    return decorate
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        addTime(self.name, time.perf_counter() - self.start)
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        pass
+
+_nullTimer = _NullTimer()
+
+def timer(name):
+    """Context manager timing a block of code as stage name, when enabled."""
+    return _Timer(name) if enabled else _nullTimer
+
+def reset():
+    with lock:
+        timers.clear()
+        counters.clear()
+
+# ********** Export ***********************************************************
+# Rates derived from a counter and the time of the stage that produced it.
+rates = {"cellsPerSecond": ("cells", "computeTable"), \
+         "formattedCellsPerSecond": ("formattedCells", "format")}
+
+def snapshot():
+    """The timers, counters and rates collected so far, as a dict."""
+    with lock:
+        stages = {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in timers.items()}
+        values = dict(counters)
+    derived = {}
+    for rate, (counter, stageName) in rates.items():
+        seconds = sum(timing["seconds"] for name, timing in stages.items() if name == stageName or name.startswith(stageName + "."))
+        if counter in values and seconds > 0:
+            derived[rate] = values[counter] / seconds
+    return {"pid": os.getpid(), "stages": stages, "counters": values, "rates": derived}
+
+def formatJson():
+    return json.dumps(snapshot(), indent=2, sort_keys=True) + "\n"
+
+def _metricName(name):
+    # camelCase to snake_case
+    return "".join(["_" + character.lower() if character.isupper() else character for character in name])
+
+def formatPrometheus(prefix = "airsoft"):
+    """The snapshot in the Prometheus text exposition format."""
+    metrics = snapshot()
+    lines = ["# TYPE {:s}_stage_calls_total counter".format(prefix)]
+    for name, timing in sorted(metrics["stages"].items()):
+        lines.append('{:s}_stage_calls_total{{stage="{:s}"}} {:d}'.format(prefix, name, timing["calls"]))
+    lines.append("# TYPE {:s}_stage_seconds_total counter".format(prefix))
+    for name, timing in sorted(metrics["stages"].items()):
+        lines.append('{:s}_stage_seconds_total{{stage="{:s}"}} {:.9f}'.format(prefix, name, timing["seconds"]))
+    for name, value in sorted(metrics["counters"].items()):
+        lines.append("# TYPE {:s}_{:s}_total counter".format(prefix, _metricName(name)))
+        lines.append("{:s}_{:s}_total {:d}".format(prefix, _metricName(name), int(value)))
+    for name, value in sorted(metrics["rates"].items()):
+        lines.append("# TYPE {:s}_{:s} gauge".format(prefix, _metricName(name)))
+        lines.append("{:s}_{:s} {:.6g}".format(prefix, _metricName(name), value))
+    return "\n".join(lines) + "\n"
+
+def export(fileName):
+    """Writes the snapshot to fileName, Prometheus text for .prom files, JSON otherwise."""
+    directory = os.path.dirname(fileName)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    file = open(fileName, "w")
+    file.write(formatPrometheus() if fileName.endswith(".prom") else formatJson())
+    file.close()
+
+# ********** Profiling ********************************************************
+def _startProfiling(mode, fileName):
+    """Starts cProfile or tracemalloc for the rest of the process and writes the result at exit."""
+    directory = os.path.dirname(fileName)
+    if mode == "cprofile":
+        import cProfile
+        profile = cProfile.Profile()
+        def dump():
+            profile.disable()
+            if directory != "":
+                os.makedirs(directory, exist_ok=True)
+            profile.dump_stats(fileName)
+        profile.enable()
+        atexit.register(dump)
+    elif mode == "tracemalloc":
+        import tracemalloc
+        def dump():
+            current, peak = tracemalloc.get_traced_memory()
+            statistics = tracemalloc.take_snapshot().statistics("lineno")
+            tracemalloc.stop()
+            if directory != "":
+                os.makedirs(directory, exist_ok=True)
+            file = open(fileName, "w")
+            file.write("Current: {:d} B, peak: {:d} B\n".format(current, peak))
+            file.write("".join([str(statistic) + "\n" for statistic in statistics[:50]]))
+            file.close()
+        tracemalloc.start()
+        atexit.register(dump)
+    else:
+        raise ValueError("Unknown AIRSOFT_PROFILE {:s}, use cprofile or tracemalloc.".format(mode))
+
+if profileMode != "":
+    _startProfiling(profileMode, os.environ.get("AIRSOFT_PROFILE_FILE", \
+                    "output/profile.pstats" if profileMode == "cprofile" else "output/tracemalloc.txt"))
+
+if enabled and os.environ.get("AIRSOFT_INSTRUMENT_FILE", "") != "":
+    atexit.register(export, os.environ["AIRSOFT_INSTRUMENT_FILE"])
@@ -0,0 +1,181 @@
+import concurrent.futures
+import numpy as np
+import DragFit
+import TableEngine as te
+import TableSweep
+
+# ********** Sampling the drag constant ***************************************
+# Every uncertain physical parameter (drag coefficient, air density, BB
+# diameter) enters the table only through the drag constant
+# k = 0.5 * Cd * rho * A, so a Monte Carlo sample of the table is a sample of k.
+
+def sampleDragConstants(nSamples, \
+                        dragCoefficient = (0.477, 0.0), \
+                        density = (1.225, 0.0), \
+                        diameter = (0.006, 0.0), \
+                        seed = None):
+    """
+    Draws drag constants from independent normal distributions of the drag
+    coefficient, the air density (Unit: kg/m^3) and the BB diameter (Unit: m),
+    each given as (mean, standard deviation), or as an array of samples of
+    length nSamples (for instance from bootstrapDragCoefficients).
+
+    Returns nSamples drag constants. Unit: kg/m
+    """
+    rng = np.random.default_rng(seed)
+    def draw(parameter):
+        if isinstance(parameter, tuple):
+            mean, standardDeviation = parameter
+            return rng.normal(mean, standardDeviation, nSamples)
+        return np.asarray(parameter, dtype=np.float64)
+    return te.dragConstant(draw(dragCoefficient), draw(diameter), draw(density))
+
+# ********** Bootstrap of the measurements ************************************
+def _bootstrapChunk(shots, counts, setOfGroup, distancesOfGroup, weights, nSamples, density, diameter, seed):
+    """Fits and combines the drag coefficients of nSamples bootstrap resamples."""
+    rng = np.random.default_rng(seed)
+    nGroups, maxShots = shots.shape
+    # Resample the shots of every (set, distance) group with replacement.
+    picks = np.floor(rng.random((nSamples, nGroups, maxShots)) * counts[np.newaxis, :, np.newaxis]).astype(int)
+    resampled = np.take_along_axis(np.broadcast_to(shots, (nSamples, nGroups, maxShots)), picks, axis=2)
+    valid = np.arange(maxShots)[np.newaxis, :] < counts[:, np.newaxis]
+    means = np.where(valid, resampled, 0).sum(axis=2) / counts
+    # Lay the group means out as one dataset per (sample, set).
+    nSets = weights.size
+    column = np.zeros(nGroups, dtype=int)
+    for i_set in range(nSets):
+        column[setOfGroup == i_set] = np.arange(np.sum(setOfGroup == i_set))
+    velocities = np.full((nSamples, nSets, column.max() + 1), np.nan)
+    velocities[:, setOfGroup, column] = means
+    distances = np.full((nSets, column.max() + 1), np.nan)
+    distances[setOfGroup, column] = distancesOfGroup
+    dragCoefficients, variances, iterations = DragFit.fitDragCoefficients(np.tile(distances, (nSamples, 1)), \
+                                                                          velocities.reshape(nSamples*nSets, -1), \
+                                                                          np.tile(weights, nSamples), density, diameter)
+    # Combine the sets of every sample, as DragFit.combineDragCoefficients.
+    precision = 1 / variances.reshape(nSamples, nSets)**2
+    return np.sum(dragCoefficients.reshape(nSamples, nSets) * precision, axis=1) / np.sum(precision, axis=1)
+
+def bootstrapDragCoefficients(measurements, \
+                              nSamples, \
+                              density = 1.184, \
+                              diameter = 0.006, \
+                              chunkSize = 1000, \
+                              processes = 1, \
+                              seed = None):
+    """
+    Bootstraps the combined drag coefficient of dataAnalyzer: the shots
+    (Value_n) at every distance of every set are resampled with replacement,
+    every set is fitted again and the sets are combined by precision.
+
+    Parameters
+    ----------
+    measurements : pd.DataFrame
+        The shots, as returned by DataLoader.loadDatasets.
+    nSamples : int
+        Number of bootstrap samples.
+    density, diameter : float
+        The air density (Unit: kg/m^3) and BB diameter (Unit: m) of the
+        measurements.
+    chunkSize : int
+        Number of samples fitted at once, bounds the memory.
+    processes : int
+        Number of worker processes the chunks are spread over.
+
+    Returns nSamples drag coefficients.
+    """
+    groups = measurements.groupby(["set", "distance"], observed=True, sort=True)["velocity"]
+    groupShots = [group.to_numpy() for key, group in groups]
+    keys = list(groups.groups.keys())
+    sets = [name for name in measurements["set"].cat.categories if name in set(key[0] for key in keys)]
+    counts = np.array([len(shots) for shots in groupShots])
+    shots = DragFit.padDatasets(groupShots)
+    setOfGroup = np.array([sets.index(key[0]) for key in keys])
+    distancesOfGroup = np.array([key[1] for key in keys], dtype=np.float64)
+    weights = measurements.groupby("set", observed=True)["weight"].first()[sets].to_numpy()
+
+    sizes = [min(chunkSize, nSamples - start) for start in range(0, nSamples, chunkSize)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    arguments = [(shots, counts, setOfGroup, distancesOfGroup, weights, size, density, diameter, chunkSeed) \
+                 for size, chunkSeed in zip(sizes, seeds)]
+    if processes <= 1:
+        return np.concatenate([_bootstrapChunk(*chunkArguments) for chunkArguments in arguments])
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(_bootstrapChunk, *chunkArguments) for chunkArguments in arguments]
+        return np.concatenate([future.result() for future in futures])
+
+# ********** Percentile bands of the table ************************************
+def _percentileBlock(masses, distances, energiesMuzzle, energiesImpact, dragConstants, percentiles, maxChunkCells):
+    """The percentiles of a block of cells over all the samples, in float32."""
+    tables = TableSweep.computeTables(masses, distances, energiesMuzzle, energiesImpact, dragConstants, maxChunkCells, dtype=np.float32)
+    return np.percentile(tables, percentiles, axis=0, method="inverted_cdf")
+
+def percentileTables(masses, \
+                     distances, \
+                     energiesMuzzle, \
+                     energiesImpact, \
+                     dragConstants, \
+                     percentiles = [5, 50, 95], \
+                     method = "monotone", \
+                     maxChunkCells = 2**22, \
+                     processes = 1):
+    """
+    Percentile bands of the maximum muzzle velocity of every class x mass
+    cell over samples of the drag constant.
+
+    Parameters
+    ----------
+    masses, distances, energiesMuzzle, energiesImpact : np.array
+        The ruleset, as for getTable. Unit: kg, m, J, J
+    dragConstants : np.array
+        The samples, see sampleDragConstants. Unit: kg/m
+    percentiles : list of float
+        The percentiles to report, P5 is the velocity limit that 95% of the
+        samples allow.
+    method : str
+        "monotone": every cell is a non-decreasing function of the drag
+        constant, so the order statistics of a cell are the table of the order
+        statistics of the constant. Only one table per percentile is computed.
+        "full": every sample table is computed (in float32) and the
+        percentiles are taken per cell. The table is done in blocks of cells
+        with all their samples, of about maxChunkCells values, so the memory
+        does not grow with the table, and the blocks are spread over the
+        worker processes. One cell still
+        needs all of its samples: a block is at least dragConstants.size
+        values.
+        Both use the inverted CDF definition of the percentile and agree up to
+        float32 rounding.
+    maxChunkCells : int
+        Upper bound on the number of float32 values computed at once by "full",
+        in every worker process.
+    processes : int
+        Number of worker processes the blocks of "full" are spread over.
+
+    Returns the bands with shape (len(percentiles), distances.size, masses.size). Unit: m/s
+    """
+    if method == "monotone":
+        constants = np.percentile(dragConstants, percentiles, method="inverted_cdf")
+        return TableSweep.computeTables(masses, distances, energiesMuzzle, energiesImpact, constants)
+    if method == "full":
+        masses = np.asarray(masses, dtype=np.float64)
+        distances, energiesMuzzle, energiesImpact = np.asarray(distances), np.asarray(energiesMuzzle), np.asarray(energiesImpact)
+        dragConstants = np.asarray(dragConstants, dtype=np.float64).reshape(-1)
+        cellsPerBlock = max(1, maxChunkCells // max(1, dragConstants.size))
+        massBlock = min(masses.size, cellsPerBlock)
+        classBlock = max(1, cellsPerBlock // max(1, massBlock))
+        blocks = [(slice(classStart, classStart + classBlock), slice(massStart, massStart + massBlock)) \
+                  for classStart in range(0, distances.size, classBlock) for massStart in range(0, masses.size, massBlock)]
+        arguments = [(masses[columns], distances[classes], energiesMuzzle[classes], energiesImpact[classes], \
+                      dragConstants, percentiles, maxChunkCells) for classes, columns in blocks]
+        bands = np.empty((len(percentiles), distances.size, masses.size))
+        if processes <= 1 or len(blocks) == 1:
+            for (classes, columns), blockArguments in zip(blocks, arguments):
+                bands[:, classes, columns] = _percentileBlock(*blockArguments)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+                futures = {executor.submit(_percentileBlock, *blockArguments): block for block, blockArguments in zip(blocks, arguments)}
+                for future in concurrent.futures.as_completed(futures):
+                    classes, columns = futures[future]
+                    bands[:, classes, columns] = future.result()
+        return bands
+    raise ValueError("Unknown method {:s}, use monotone or full.".format(method))
@@ -0,0 +1,130 @@
+import concurrent.futures
+import os
+import numpy as np
+import DragFit
+import Instrumentation
+
+# ********** Plot data ********************************************************
+# matplotlib is only imported by the functions that draw, in the process that
+# draws, so computing without plotting never loads it. The figures are plain
+# matplotlib.figure.Figure objects on the Agg canvas, without pyplot and its
+# interactive backends.
+
+def fitPlotData(measurements, dragCoefficients, dragCoefficientMean, density = 1.184, diameter = 0.006, samples = 50):
+    """
+    The data of the fit plot of every set of a DataLoader.loadDatasets table,
+    with dragCoefficients in the order of DataLoader.meanVelocities:
+    a list of dicts with the set name, gun, weight (Unit: kg), the shots
+    (distance, velocity), and the model of the set's own drag coefficient and
+    of the combined one, all model curves computed at once.
+    """
+    groups = [(name, shots) for name, shots in measurements.groupby("set", observed=True)]
+    firstVelocities = [shots.loc[shots["distance"] == shots["distance"].min(), "velocity"].mean() for name, shots in groups]
+    weights = np.array([shots["weight"].iloc[0] for name, shots in groups])
+    xrange = np.linspace(0, measurements["distance"].max(), samples)
+    xranges = np.tile(xrange, (len(groups), 1))
+    fits = DragFit.modelVelocities(xranges, firstVelocities, weights, np.asarray(dragCoefficients), density, diameter)
+    means = DragFit.modelVelocities(xranges, firstVelocities, weights, dragCoefficientMean, density, diameter)
+    return [{"name": str(name), "gun": str(shots["gun"].iloc[0]), "weight": float(weights[i_set]), \
+             "distances": shots["distance"].to_numpy(), "velocities": shots["velocity"].to_numpy(), \
+             "dragCoefficient": float(np.asarray(dragCoefficients)[i_set]), "dragCoefficientMean": float(dragCoefficientMean), \
+             "xrange": xrange, "fit": fits[i_set], "mean": means[i_set]} \
+            for i_set, (name, shots) in enumerate(groups)]
+
+# ********** Dataset plots ****************************************************
+_figure = {}
+
+def _setupFigure(width = 6.4, height = 4.8, dpi = 100):
+    """Creates the figure and its artists once per process, every dataset reuses them."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure(figsize=(width, height), dpi=dpi)
+    FigureCanvasAgg(figure)
+    axis = figure.add_subplot()
+    _figure["figure"] = figure
+    _figure["axis"] = axis
+    _figure["shots"] = axis.scatter(np.zeros(0), np.zeros(0), marker="D", color="b")
+    _figure["fit"], = axis.plot([], [], "r-")
+    _figure["mean"], = axis.plot([], [], "k--")
+    _figure["legend"] = axis.legend([_figure["shots"], _figure["fit"], _figure["mean"]], \
+                                    ["Measurements", "Fit of the set", "Combined fit"], loc="upper right")
+    axis.grid()
+    axis.set_xlabel("Distance [m]")
+    axis.set_ylabel("Velocity [m/s]")
+
+def _renderDatasets(datasets, directory, formats):
+    """Draws every dataset into the reused figure and saves it. Returns the files written."""
+    if len(_figure) == 0:
+        _setupFigure()
+    figure, axis = _figure["figure"], _figure["axis"]
+    fileNames = []
+    for dataset in datasets:
+        _figure["shots"].set_offsets(np.column_stack([dataset["distances"], dataset["velocities"]]))
+        _figure["fit"].set_data(dataset["xrange"], dataset["fit"])
+        _figure["mean"].set_data(dataset["xrange"], dataset["mean"])
+        legendTexts = _figure["legend"].get_texts()
+        legendTexts[1].set_text("Fit of the set, c = {:.3f}".format(dataset["dragCoefficient"]))
+        legendTexts[2].set_text("Combined fit, c = {:.3f}".format(dataset["dragCoefficientMean"]))
+        # Collections are not part of relim, the limits are set from the data.
+        values = np.concatenate([dataset["velocities"], dataset["fit"], dataset["mean"]])
+        margin = 0.05 * max(np.ptp(values), 1)
+        axis.set_xlim(0, dataset["xrange"][-1] * 1.02)
+        axis.set_ylim(np.min(values) - margin, np.max(values) + margin)
+        axis.set_title("{:s}: {:s}, {:.2f} g".format(dataset["name"], dataset["gun"], dataset["weight"] * 1000))
+        for extension in formats:
+            fileName = os.path.join(directory, "{:s}.{:s}".format(dataset["name"], extension))
+            figure.savefig(fileName, format=extension)
+            fileNames.append(fileName)
+    return fileNames
+
+@Instrumentation.stage("plot.datasets")
+def renderDatasetPlots(datasets, directory = "output/plots", formats = ["png"], processes = 1, chunkSize = 16):
+    """
+    Saves the fit plot of every dataset (see fitPlotData) to directory, as
+    <set>.png and/or <set>.svg. Each worker process draws its chunks of
+    datasets into one figure whose artists are updated, not recreated.
+
+    Returns the files written, in the order of datasets.
+    """
+    os.makedirs(directory, exist_ok=True)
+    chunks = [datasets[start:start + chunkSize] for start in range(0, len(datasets), chunkSize)]
+    if processes <= 1 or len(chunks) <= 1:
+        return [fileName for chunk in chunks for fileName in _renderDatasets(chunk, directory, formats)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=_setupFigure) as executor:
+        futures = [executor.submit(_renderDatasets, chunk, directory, formats) for chunk in chunks]
+        return [fileName for future in futures for fileName in future.result()]
+
+# ********** Overview plot ****************************************************
+def overviewFigure(datasets, colors = ['b', 'g', 'r', 'c', 'm', 'y']):
+    """
+    The plot of dataAnalyzer: the combined model of every set as one line
+    collection and the shots of every set as one marker collection.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import LineCollection
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axis = figure.add_subplot()
+    axis.add_collection(LineCollection([np.column_stack([dataset["xrange"], dataset["mean"]]) for dataset in datasets], \
+                                       colors="k", linestyles="--"))
+    for i_set, dataset in enumerate(datasets):
+        axis.scatter(dataset["distances"], dataset["velocities"], marker="D", color=colors[i_set % len(colors)], label=dataset["name"])
+    axis.autoscale_view()
+    axis.legend()
+    axis.grid()
+    axis.set_xlabel("Distance [m]")
+    axis.set_ylabel("Velocity [m/s]")
+    axis.set_title("Exponential decay model compared with measurements")
+    return figure
+
+@Instrumentation.stage("plot.overview")
+def renderOverview(datasets, fileNames = ["output/dataAnalyzerPlot.png"]):
+    """Saves overviewFigure to every file name, the format is given by the extension."""
+    figure = overviewFigure(datasets)
+    for fileName in fileNames:
+        directory = os.path.dirname(fileName)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        figure.savefig(fileName)
+    return fileNames
@@ -0,0 +1,233 @@
+import numpy as np
+
+mps2fps = 3.28084
+
+# ********** Read-only buffers ************************************************
+def isReadOnly(array):
+    """
+    True if nothing can write to the data of array: neither the array nor any
+    array it is a view of is writeable.
+    """
+    while isinstance(array, np.ndarray):
+        if array.flags.writeable:
+            return False
+        array = array.base
+    return True
+
+def readOnlyArray(array, dtype = None):
+    """
+    A C-contiguous, read-only array with the data of array. Arrays that
+    already are are returned as they are, everything else is copied.
+    """
+    if isinstance(array, np.ndarray) and isReadOnly(array) and array.flags.c_contiguous and (dtype is None or array.dtype == dtype):
+        return array
+    array = np.array(array, dtype=dtype, order="C")
+    array.flags.writeable = False
+    return array
+
+# ********** Memory mapped .npz ***********************************************
+def _mmapNpz(fileName):
+    """
+    Memory maps every array of an uncompressed .npz file (np.savez), as
+    np.load(mmap_mode="r") does for a .npy file.
+    """
+    import zipfile
+    arrays = {}
+    with zipfile.ZipFile(fileName, "r") as archive, open(fileName, "rb") as file:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError("{:s} in {:s} is compressed and can not be memory mapped.".format(info.filename, fileName))
+            # The local file header: 30 bytes, the name and an extra field.
+            file.seek(info.header_offset + 26)
+            nameLength, extraLength = np.frombuffer(file.read(4), dtype="<u2")
+            file.seek(info.header_offset + 30 + int(nameLength) + int(extraLength))
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortranOrder, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortranOrder, dtype = np.lib.format.read_array_header_2_0(file)
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if dtype.hasobject or shape == () or 0 in shape:
+                # Scalars, empty and object arrays can not be mapped, they are small.
+                with archive.open(info.filename) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+            else:
+                arrays[name] = np.memmap(fileName, dtype=dtype, mode="r", offset=file.tell(), shape=shape, \
+                                         order="F" if fortranOrder else "C")
+    return arrays
+
+# ********** Safety table *****************************************************
+class SafetyTable:
+    """
+    An immutable safety table: the ruleset it was computed from together with
+    the muzzle velocities. All arrays are contiguous and read-only, so a table
+    can be handed to any pipeline stage (or cached, or memory mapped in other
+    processes) without defensive copies.
+
+    Attributes
+    ----------
+    masses : np.array
+        BB masses. Unit: kg
+    distances : np.array
+        Safety distance of every class. Unit: m
+    energiesMuzzle, energiesImpact : np.array
+        Max energy at the muzzle and at the safety distance of every class. Unit: J
+    classNames : tuple of str
+    muzzleVelocities : np.array
+        Max muzzle velocity of every class (rows) and mass (columns). Unit: m/s
+    constant : float
+        The drag constant 0.5*Cd*rho*A. Unit: kg/m
+
+    Arrays that are not read-only already are copied. Attributes can not be
+    set after construction.
+    """
+    __slots__ = ("masses", "distances", "energiesMuzzle", "energiesImpact", "classNames", "muzzleVelocities", "constant", "_views")
+
+    def __init__(self, masses, distances, energiesMuzzle, energiesImpact, classNames, muzzleVelocities, constant):
+        if len(distances) != len(classNames):
+            raise ValueError("Missmatch between class names ({:d}) and distances ({:d}).".format(len(classNames), len(distances)))
+        muzzleVelocities = readOnlyArray(muzzleVelocities)
+        if muzzleVelocities.shape != (len(distances), len(masses)):
+            raise ValueError("Muzzle velocities of shape {:s} do not match {:d} classes x {:d} masses.".format(str(muzzleVelocities.shape), len(distances), len(masses)))
+        setSlot = object.__setattr__
+        setSlot(self, "masses", readOnlyArray(masses, np.float64))
+        setSlot(self, "distances", readOnlyArray(distances))
+        setSlot(self, "energiesMuzzle", readOnlyArray(energiesMuzzle, np.float64))
+        setSlot(self, "energiesImpact", readOnlyArray(energiesImpact, np.float64))
+        setSlot(self, "classNames", tuple(classNames))
+        setSlot(self, "muzzleVelocities", muzzleVelocities)
+        setSlot(self, "constant", constant)
+        setSlot(self, "_views", {})
+
+    @classmethod
+    def fromOwned(cls, masses, distances, energiesMuzzle, energiesImpact, classNames, muzzleVelocities, constant):
+        """
+        A table that takes over the muzzle velocity buffer instead of copying
+        it: muzzleVelocities is made read-only in place and must not be
+        written through any other reference afterwards. Views of other arrays
+        are copied and left as they are, they can not be made read-only.
+        """
+        if isinstance(muzzleVelocities, np.ndarray) and muzzleVelocities.flags.c_contiguous and muzzleVelocities.flags.owndata:
+            muzzleVelocities.flags.writeable = False
+        return cls(masses, distances, energiesMuzzle, energiesImpact, classNames, muzzleVelocities, constant)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SafetyTable is immutable, {:s} can not be set.".format(name))
+
+    def __delattr__(self, name):
+        raise AttributeError("SafetyTable is immutable, {:s} can not be deleted.".format(name))
+
+    def __reduce__(self):
+        # Unpickled arrays are fresh and owned by nobody else.
+        return (SafetyTable.fromOwned, (self.masses, self.distances, self.energiesMuzzle, self.energiesImpact, \
+                                        self.classNames, np.array(self.muzzleVelocities), self.constant))
+
+    def __repr__(self):
+        return "SafetyTable({:d} classes x {:d} masses, constant={:g})".format(len(self.classNames), self.masses.size, self.constant)
+
+    @property
+    def shape(self):
+        return self.muzzleVelocities.shape
+
+    def astuple(self):
+        """The (masses, distances, muzzleVelocities, constant) tuple returned by getTable."""
+        return self.masses, self.distances, self.muzzleVelocities, self.constant
+
+    # ********** Unit views ***************************************************
+    def _view(self, name, compute):
+        # The table is immutable, so derived arrays are computed once and shared.
+        if name not in self._views:
+            self._views[name] = readOnlyArray(compute())
+        return self._views[name]
+
+    def velocities(self, unit = "m/s"):
+        """The muzzle velocities in m/s (the buffer itself) or fps."""
+        if unit == "m/s":
+            return self.muzzleVelocities
+        if unit == "fps":
+            return self._view("fps", lambda: self.muzzleVelocities * mps2fps)
+        raise ValueError("Unknown unit {:s}, use m/s or fps.".format(unit))
+
+    def muzzleEnergies(self):
+        """The kinetic energy at the muzzle of every cell. Unit: J"""
+        return self._view("muzzleEnergies", lambda: self.masses * self.muzzleVelocities * self.muzzleVelocities * 0.5)
+
+    def impactEnergies(self):
+        """The kinetic energy at the safety distance of every cell. Unit: J"""
+        return self._view("impactEnergies", lambda: self.muzzleEnergies() * \
+                          np.exp(-2 * self.constant * self.distances[:, np.newaxis] / self.masses[np.newaxis, :]))
+
+    # ********** Slicing ******************************************************
+    def classIndex(self, className):
+        """Index of a class by name. Raises KeyError for unknown classes."""
+        try:
+            return self.classNames.index(className)
+        except ValueError:
+            raise KeyError(className) from None
+
+    def _classSelection(self, classes):
+        if isinstance(classes, str):
+            return [self.classIndex(classes)]
+        if isinstance(classes, (list, tuple)):
+            return [self.classIndex(name) if isinstance(name, str) else name for name in classes]
+        if isinstance(classes, (int, np.integer)):
+            # Keep the class axis, a table always has two.
+            return slice(classes, classes + 1) if classes != -1 else slice(-1, None)
+        return classes
+
+    def __getitem__(self, key):
+        """
+        A sub-table: table[classes] or table[classes, masses]. Classes are
+        selected by index, slice, name or list of names, masses by index,
+        slice or list of indices (see selectMasses for values). A slice of
+        classes with all masses shares the buffer of this table, other
+        selections are copied to keep the table contiguous.
+        """
+        classes, masses = key if isinstance(key, tuple) else (key, slice(None))
+        classes = self._classSelection(classes)
+        if isinstance(masses, (int, np.integer)):
+            masses = slice(masses, masses + 1) if masses != -1 else slice(-1, None)
+        classNames = np.array(self.classNames, dtype=object)[classes]
+        return SafetyTable(self.masses[masses], self.distances[classes], self.energiesMuzzle[classes], self.energiesImpact[classes], \
+                           list(classNames), self.muzzleVelocities[classes][:, masses], self.constant)
+
+    def selectMasses(self, masses):
+        """The sub-table of the given masses (Unit: kg), which must be in the table."""
+        masses = np.atleast_1d(np.asarray(masses, dtype=np.float64))
+        indices = np.searchsorted(self.masses, masses)
+        indices = np.minimum(indices, self.masses.size - 1)
+        if np.any(~np.isclose(self.masses[indices], masses, rtol=1e-9, atol=0)):
+            raise KeyError("Masses {:s} are not in the table.".format(str(masses[~np.isclose(self.masses[indices], masses, rtol=1e-9, atol=0)])))
+        return self[:, list(indices)]
+
+    # ********** Serialization ************************************************
+    def save(self, fileName):
+        """
+        Writes the table to an uncompressed .npz file, which load can memory
+        map. The class names are stored as a fixed width unicode array.
+        """
+        np.savez(fileName, \
+                 masses=self.masses, \
+                 distances=self.distances, \
+                 energiesMuzzle=self.energiesMuzzle, \
+                 energiesImpact=self.energiesImpact, \
+                 classNames=np.array(self.classNames, dtype=str), \
+                 muzzleVelocities=self.muzzleVelocities, \
+                 constant=np.array(self.constant, dtype=np.float64))
+
+    @classmethod
+    def load(cls, fileName, mmap = False):
+        """
+        Reads a table written by save. With mmap the arrays are read-only
+        memory maps of the file, so that many processes can share one table
+        without copying it.
+        """
+        if mmap:
+            arrays = _mmapNpz(fileName)
+        else:
+            with np.load(fileName, allow_pickle=False) as file:
+                arrays = {name: file[name] for name in file.files}
+        for name in ["masses", "distances", "energiesMuzzle", "energiesImpact", "muzzleVelocities"]:
+            arrays[name].flags.writeable = False
+        return cls(arrays["masses"], arrays["distances"], arrays["energiesMuzzle"], arrays["energiesImpact"], \
+                   [str(name) for name in arrays["classNames"]], arrays["muzzleVelocities"], float(arrays["constant"]))
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+import numpy as np
+
+# ********** Measurement ******************************************************
+# Every run is a fresh interpreter, as in a short-lived worker process. The
+# child reports the time to import numpy, to import the generator and to
+# compute the first ruleset table.
+childScript = """
+import time
+start = time.perf_counter()
+import numpy
+numpyImported = time.perf_counter()
+import AirsoftSafetyTableGenerator
+imported = time.perf_counter()
+AirsoftSafetyTableGenerator.computeRulesetTable("{ruleset:s}")
+firstTable = time.perf_counter()
+print(numpyImported - start, imported - numpyImported, firstTable - imported)
+"""
+
+def measureStartup(ruleset = "vsaf2020", runs = 10):
+    """Returns the times of every run as an array of (numpy import, generator import, first table). Unit: s"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for i in range(runs):
+        output = subprocess.run([sys.executable, "-c", childScript.format(ruleset=ruleset)], \
+                                cwd=directory, capture_output=True, text=True, check=True).stdout
+        times.append([float(value) for value in output.split()])
+    return np.array(times)
+
+if __name__ == "__main__":
+    times = measureStartup()
+    median = np.median(times, axis=0) * 1000
+    print("Median over {:d} runs:".format(times.shape[0]))
+    print("  import numpy:                      {:8.2f} ms".format(median[0]))
+    print("  import AirsoftSafetyTableGenerator: {:8.2f} ms".format(median[1]))
+    print("  first table:                       {:8.2f} ms".format(median[2]))
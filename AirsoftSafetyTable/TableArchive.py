@@ -0,0 +1,321 @@
+import json
+import re
+import time
+import numpy as np
+import AirsoftSafetyTableGenerator
+import Instrumentation
+import SafetyTable
+import TableComparator
+import TableFormatter as tf
+
+# ********** File format ******************************************************
+# A table archive (.astb) holds one or more safety tables in a form that can
+# be memory mapped and read without parsing any numbers:
+#
+#   magic        8 bytes   b"ASTABLE\0"
+#   version      2 x <u2   major, minor
+#   headerLength <u4       length of the header in bytes, padding included
+#   header       UTF-8 JSON, padded with spaces to the alignment
+#   arrays       the arrays of every table, each one starting on an
+#                alignment boundary, little endian, C order
+#
+# The header is {"tables": [...]} with, for every table, the ruleset
+# metadata (name, drag coefficient, diameter, density), the class names, the
+# drag constant and, for every array (masses, distances, energiesMuzzle,
+# energiesImpact, muzzleVelocities), its dtype, shape and offset from the start
+# of the file. The distances keep their dtype, integer and float distances
+# are formatted differently in the text outputs.
+#
+# A reader refuses files of a newer major version. Minor versions only add
+# header keys, which older readers ignore.
+
+magic = b"ASTABLE\0"
+formatVersion = (1, 0)
+alignment = 64 # bytes
+arrayNames = ["masses", "distances", "energiesMuzzle", "energiesImpact", "muzzleVelocities"]
+_prefixSize = len(magic) + 8
+
+def _aligned(offset):
+    return -(-offset // alignment) * alignment
+
+def _littleEndian(array):
+    array = np.asarray(array)
+    return np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+
+def rulesetMetadata(name):
+    """The metadata of a registered ruleset, with the getTable defaults for missing constants."""
+    ruleset = AirsoftSafetyTableGenerator.getRuleset(name)
+    return {"ruleset": name, \
+            "dragCoefficient": ruleset.get("dragCoefficient", 0.477), \
+            "diameter": ruleset.get("diameter", 0.006), \
+            "density": ruleset.get("density", 1.225)}
+
+# ********** Writer ***********************************************************
+@Instrumentation.stage("archive.write")
+def writeTables(fileName, tables, metadata = None):
+    """
+    Writes SafetyTables to a table archive.
+
+    Parameters
+    ----------
+    fileName : str
+    tables : list of SafetyTable
+    metadata : list of dict
+        Optional JSON serializable metadata of every table, for instance
+        rulesetMetadata. Default: None
+
+    Returns the number of bytes written.
+    """
+    if metadata is None:
+        metadata = [{} for table in tables]
+    if len(metadata) != len(tables):
+        raise ValueError("Missmatch between tables ({:d}) and metadata ({:d}).".format(len(tables), len(metadata)))
+    # The offsets depend on the header length, which depends on the offsets:
+    # lay out the arrays after a header estimate until the header fits.
+    arrays = [[_littleEndian(getattr(table, name)) for name in arrayNames] for table in tables]
+    headerLength = _aligned(_prefixSize) - _prefixSize
+    while True:
+        offset = _prefixSize + headerLength
+        entries = []
+        for table, tableMetadata, tableArrays in zip(tables, metadata, arrays):
+            descriptors = {}
+            for name, array in zip(arrayNames, tableArrays):
+                offset = _aligned(offset)
+                descriptors[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+                offset += array.nbytes
+            entries.append({"metadata": tableMetadata, \
+                            "classNames": list(table.classNames), \
+                            "constant": float(table.constant), \
+                            "arrays": descriptors})
+        header = json.dumps({"tables": entries}, ensure_ascii=False).encode("utf-8")
+        if len(header) <= headerLength:
+            break
+        headerLength = _aligned(_prefixSize + len(header)) - _prefixSize
+    header += b" " * (headerLength - len(header))
+
+    with open(fileName, "wb") as file:
+        file.write(magic)
+        file.write(np.array(formatVersion, dtype="<u2").tobytes())
+        file.write(np.array([headerLength], dtype="<u4").tobytes())
+        file.write(header)
+        for entry, tableArrays in zip(entries, arrays):
+            for name, array in zip(arrayNames, tableArrays):
+                file.write(b"\0" * (entry["arrays"][name]["offset"] - file.tell()))
+                file.write(array.data if array.size > 0 else b"")
+        written = file.tell()
+    if Instrumentation.enabled:
+        Instrumentation.count("bytesWritten", written)
+    return written
+
+def writeTable(fileName, table, metadata = None):
+    """Writes one SafetyTable to a table archive, see writeTables."""
+    return writeTables(fileName, [table], None if metadata is None else [metadata])
+
+def exportRulesets(fileName, names = None):
+    """Computes registered rulesets (default: all of them) and writes them to one table archive."""
+    names = sorted(AirsoftSafetyTableGenerator.rulesets) if names is None else names
+    tables = [AirsoftSafetyTableGenerator.computeRulesetTable(name) for name in names]
+    return writeTables(fileName, tables, [rulesetMetadata(name) for name in names])
+
+# ********** Reader ***********************************************************
+def _parseHeader(buffer, fileName):
+    if bytes(buffer[:len(magic)]) != magic:
+        raise ValueError("{:s} is not a table archive.".format(fileName))
+    major, minor = np.frombuffer(buffer, dtype="<u2", count=2, offset=len(magic))
+    headerLength = int(np.frombuffer(buffer, dtype="<u4", count=1, offset=len(magic) + 4)[0])
+    if major > formatVersion[0]:
+        raise ValueError("{:s} is a version {:d}.{:d} table archive, this reader supports version {:d}.x.".format(fileName, major, minor, formatVersion[0]))
+    header = json.loads(bytes(buffer[_prefixSize:_prefixSize + headerLength]).decode("utf-8"))
+    header["version"] = (int(major), int(minor))
+    return header
+
+def readHeader(fileName):
+    """The header of a table archive as a dict, with its (major, minor) version."""
+    with open(fileName, "rb") as file:
+        prefix = file.read(_prefixSize)
+        headerLength = int(np.frombuffer(prefix, dtype="<u4", count=1, offset=len(magic) + 4)[0]) if len(prefix) == _prefixSize else 0
+        return _parseHeader(prefix + file.read(headerLength), fileName)
+
+@Instrumentation.stage("archive.read")
+def readTables(fileName, mmap = True):
+    """
+    Reads every table of a table archive. With mmap the arrays of the tables
+    are read-only views of one memory map of the file, nothing is copied and
+    only the pages that are used are read. Otherwise the file is read once
+    and the arrays are views of that buffer.
+
+    Returns the list of SafetyTables and the list of their metadata.
+    """
+    if mmap:
+        buffer = np.memmap(fileName, dtype=np.uint8, mode="r")
+    else:
+        with open(fileName, "rb") as file:
+            buffer = file.read()
+    header = _parseHeader(buffer, fileName)
+    tables = []
+    metadata = []
+    for entry in header["tables"]:
+        arrays = {}
+        for name in arrayNames:
+            descriptor = entry["arrays"][name]
+            dtype = np.dtype(descriptor["dtype"])
+            shape = tuple(descriptor["shape"])
+            count = int(np.prod(shape))
+            if descriptor["offset"] + count * dtype.itemsize > len(buffer):
+                raise ValueError("{:s} is truncated, {:s} ends after the end of the file.".format(fileName, name))
+            if count == 0:
+                array = np.zeros(shape, dtype=dtype)
+                array.flags.writeable = False
+            else:
+                array = np.frombuffer(buffer, dtype=dtype, count=count, offset=descriptor["offset"]).reshape(shape)
+            arrays[name] = array
+        tables.append(SafetyTable.SafetyTable(arrays["masses"], arrays["distances"], arrays["energiesMuzzle"], arrays["energiesImpact"], \
+                                              entry["classNames"], arrays["muzzleVelocities"], entry["constant"]))
+        metadata.append(entry["metadata"])
+    return tables, metadata
+
+def readTable(fileName, index = 0, mmap = True):
+    """One table of a table archive and its metadata, see readTables."""
+    tables, metadata = readTables(fileName, mmap)
+    return tables[index], metadata[index]
+
+# ********** Text converters **************************************************
+# The LaTeX and HTML tables of TableFormatter and the array2string dumps of
+# TableAnalyzer can be read back into SafetyTables. The text only has the
+# velocities to 0.1 m/s (or fps) and none of the energy limits or the drag
+# constant, those are given as arguments or left unknown (NaN). Reading a text
+# output and formatting the table again gives the same text.
+
+def _textTable(masses, distances, velocities, classNames, energiesMuzzle, energiesImpact, constant):
+    unknown = np.full(len(classNames), np.nan)
+    return SafetyTable.SafetyTable(masses, distances, \
+                                   unknown if energiesMuzzle is None else energiesMuzzle, \
+                                   unknown if energiesImpact is None else energiesImpact, \
+                                   classNames, velocities, constant)
+
+def _parseGram(word):
+    # The inverse of TableFormatter.toGram, ".20" is 20/100000 kg
+    return float(word.lstrip(".")) / 100000
+
+def _parseDistances(words):
+    # Integer distances are printed without a decimal point.
+    try:
+        return np.array([int(word) for word in words])
+    except ValueError:
+        return np.array([float(word) for word in words])
+
+def toLatex(table, outputFile = None):
+    """The LaTeX table of a SafetyTable, see TableFormatter.formatLatexTable."""
+    return tf.formatLatexTable(table.masses, table.distances, table.muzzleVelocities, list(table.classNames), outputFile)
+
+def fromLatex(text, energiesMuzzle = None, energiesImpact = None, constant = np.nan):
+    """A SafetyTable read from a LaTeX table of TableFormatter.formatLatexTable."""
+    separator = "\t&\t"
+    lineEnding = "\t\\\\"
+    lines = [line[:-len(lineEnding)] for line in text.split("\n") if line.endswith(lineEnding)]
+    if len(lines) == 0:
+        raise ValueError("No LaTeX table rows found.")
+    masses = np.array([_parseGram(word[len("{\\bf "):-1]) for word in lines[0].split(separator)[2:]])
+    rows = [line.split(separator) for line in lines[1:]]
+    velocities = np.array([[float(word) for word in row[2:]] for row in rows]).reshape(len(rows), masses.size)
+    return _textTable(masses, _parseDistances([row[1] for row in rows]), velocities, [row[0] for row in rows], \
+                      energiesMuzzle, energiesImpact, constant)
+
+def toHtml(table, outputFile = None, fps = False):
+    """The HTML table of a SafetyTable, see TableFormatter.formatHtmlTable."""
+    return tf.formatHtmlTable(table.masses, table.distances, table.muzzleVelocities, list(table.classNames), outputFile, fps)
+
+def fromHtml(text, energiesMuzzle = None, energiesImpact = None, constant = np.nan):
+    """A SafetyTable read from an HTML table of TableFormatter.formatHtmlTable, in m/s or fps."""
+    title = re.search(r"\((fps|m/s)\)</th>", text)
+    if title is None:
+        raise ValueError("No HTML safety table found.")
+    masses = np.array([_parseGram(word) for word in re.findall(r"<th>(\.\d+)g</th>", text)])
+    rows = re.findall(r"<tr bgcolor=[^>]*>\n\t\t\t<td>(.*?)</td>\n\t\t\t<td>(.*?)m</td>\n((?:\t\t\t<td>.*?</td>\n)*)\t\t</tr>", text)
+    velocities = np.array([[float(word) for word in re.findall(r"<td>(.*?)</td>", cells)] for name, distance, cells in rows])
+    velocities = velocities.reshape(len(rows), masses.size)
+    if title.group(1) == "fps":
+        velocities = velocities / SafetyTable.mps2fps
+    return _textTable(masses, _parseDistances([distance for name, distance, cells in rows]), velocities, [name for name, distance, cells in rows], \
+                      energiesMuzzle, energiesImpact, constant)
+
+def toArrayText(table, label = ""):
+    """
+    The masses (Unit: g), distances and muzzle velocities of a SafetyTable as
+    printed by TableAnalyzer (see TableComparator.formatComparison), with
+    label appended to MuzzleVelocities.
+    """
+    quantities = [("Masses", table.masses*1000, 2), \
+                  ("Distances", table.distances, 1), \
+                  ("MuzzleVelocities" + label, table.muzzleVelocities, 1)]
+    with np.printoptions(linewidth=100, suppress=True):
+        return "".join([name + " " + np.array2string(values, prefix=name + " ", separator=', ', precision=precision) + "\n" \
+                        for name, values, precision in quantities])
+
+_numberPattern = re.compile(r"[-+]?(?:nan|inf|(?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?)", re.I)
+
+def _parseArray(text):
+    """An np.array2string, including the nan and inf it prints, as an array."""
+    if _numberPattern.sub("", text).strip("[], \n") != "":
+        raise ValueError("Malformed array {:s}.".format(text))
+    values = np.array([float(word) for word in _numberPattern.findall(text)], dtype=np.float64)
+    # The number of brackets opened at every depth gives the shape.
+    opened = []
+    depth = 0
+    for bracket in re.findall(r"[\[\]]", text):
+        if bracket == "[":
+            opened += [0] * (depth + 1 - len(opened))
+            opened[depth] += 1
+            depth += 1
+        else:
+            depth -= 1
+    shape = [opened[i] // opened[i - 1] for i in range(1, len(opened))]
+    return values.reshape(shape + [-1])
+
+def parseArrayText(text):
+    """Reads text of names followed by an np.array2string, as TableAnalyzer writes it, into a dict of arrays."""
+    arrays = {}
+    for match in re.finditer(r"^([A-Za-z]+) (\[.*?\])\s*(?=^[A-Za-z]|\Z)", text, re.S | re.M):
+        arrays[match.group(1)] = _parseArray(match.group(2))
+    return arrays
+
+def fromArrayText(text, label = "", classNames = None, energiesMuzzle = None, energiesImpact = None, constant = np.nan):
+    """
+    A SafetyTable read from toArrayText or from a TableAnalyzer output, where
+    label ("Old" or "New") picks one of the two tables on the joined distance
+    axis. The text has no class names, the default names them by index.
+    """
+    arrays = parseArrayText(text)
+    for name in ["Masses", "Distances", "MuzzleVelocities" + label]:
+        if name not in arrays:
+            raise ValueError("No {:s} found.".format(name))
+    distances = arrays["Distances"]
+    if np.all(distances == np.round(distances)):
+        distances = distances.astype(np.int64)
+    if classNames is None:
+        classNames = ["Class {:d}".format(i_class) for i_class in range(distances.size)]
+    velocities = arrays["MuzzleVelocities" + label].reshape(distances.size, arrays["Masses"].size)
+    return _textTable(arrays["Masses"] / 1000, distances, velocities, classNames, energiesMuzzle, energiesImpact, constant)
+
+# ********** Test *************************************************************
+if __name__ == "__main__":
+    fileName = "output/rulesets.astb"
+    start = time.perf_counter()
+    written = exportRulesets(fileName)
+    print("Wrote {:d} B in {:.3f} s".format(written, time.perf_counter() - start))
+    start = time.perf_counter()
+    tables, metadata = readTables(fileName)
+    print("Mapped {:d} tables in {:.6f} s".format(len(tables), time.perf_counter() - start))
+    for table, tableMetadata in zip(tables, metadata):
+        latex = toLatex(table)
+        html = toHtml(table)
+        print("{:20s} {:s}, LaTeX round trip {:s}, HTML round trip {:s}".format(tableMetadata["ruleset"], repr(table), \
+              "ok" if toLatex(fromLatex(latex)) == latex else "failed", \
+              "ok" if toHtml(fromHtml(html)) == html else "failed"))
+    # A comparison with masses outside of one table prints NaN.
+    masses, distances, velocities, classNames = AirsoftSafetyTableGenerator.vsaf2019Table()
+    table = AirsoftSafetyTableGenerator.computeRulesetTable("vsaf2020")
+    comparison = TableComparator.compareTables(masses, distances, velocities, table.masses, table.distances, table.muzzleVelocities, table.constant)
+    report = TableComparator.formatComparison(comparison)
+    tableOld = fromArrayText(report, "Old")
+    print("{:20s} {:s}, NaN cells {:d}".format("vsaf2019 report", repr(tableOld), int(np.sum(np.isnan(tableOld.muzzleVelocities)))))
@@ -0,0 +1,149 @@
+import collections
+import hashlib
+import os
+import threading
+import numpy as np
+import SafetyTable
+import TableEngine as te
+
+# ********** Cache keys *******************************************************
+def tableKey(masses, distances, energiesMuzzle, energiesImpact, dragCoefficient = 0.477, diameter = 0.006, density = 1.225, dtype = np.float64):
+    """
+    Content address of a table: a hash of everything the muzzle velocities
+    depend on. The class names only label the rows and are not part of it.
+    """
+    digest = hashlib.sha1()
+    for array in [masses, distances, energiesMuzzle, energiesImpact]:
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    digest.update(np.array([dragCoefficient, diameter, density], dtype=np.float64).tobytes())
+    digest.update(np.dtype(dtype).str.encode())
+    return digest.hexdigest()
+
+# ********** Cache ************************************************************
+class TableCache:
+    """
+    Memoizes computed muzzle velocity tables by their physical parameters.
+
+    Parameters
+    ----------
+    maxEntries : int
+        Number of tables kept in memory, least recently used first out.
+    directory : str
+        Optional directory of the on-disk layer, one .npy file per table.
+        None keeps the cache in process.
+    maxDiskBytes : int
+        Size bound of the on-disk layer, least recently used files first out.
+    mmap : bool
+        Memory map the tables read from disk instead of loading them.
+
+    Cached tables are read-only, the same array is handed to every caller.
+    """
+    def __init__(self, maxEntries = 128, directory = None, maxDiskBytes = 256 * 2**20, mmap = False):
+        self.maxEntries = maxEntries
+        self.directory = directory
+        self.maxDiskBytes = maxDiskBytes
+        self.mmap = mmap
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "diskHits": 0, "misses": 0, "evictions": 0, "diskEvictions": 0}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def get(self, key):
+        """Returns the cached table of key, or None."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return self.entries[key]
+        if self.directory is not None and os.path.exists(self._path(key)):
+            try:
+                table = np.load(self._path(key), mmap_mode="r" if self.mmap else None)
+            except (OSError, ValueError):
+                table = None
+            if table is not None:
+                # Touch the file, so that disk eviction is least recently used.
+                os.utime(self._path(key))
+                table.flags.writeable = False
+                with self.lock:
+                    self.stats["diskHits"] += 1
+                self._putMemory(key, table)
+                return table
+        with self.lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, key, table):
+        """Stores table read-only, a copy unless it already is, and returns it."""
+        table = SafetyTable.readOnlyArray(table)
+        self._putMemory(key, table)
+        if self.directory is not None:
+            temporary = self._path(key) + ".{:d}.tmp".format(os.getpid())
+            with open(temporary, "wb") as file:
+                np.save(file, table)
+            os.replace(temporary, self._path(key))
+            self._evictDisk()
+        return table
+
+    def _putMemory(self, key, table):
+        with self.lock:
+            self.entries[key] = table
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def _evictDisk(self):
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".npy")]
+        files = [(os.path.getmtime(name), os.path.getsize(name), name) for name in files]
+        size = sum(fileSize for mtime, fileSize, name in files)
+        for mtime, fileSize, name in sorted(files):
+            if size <= self.maxDiskBytes:
+                break
+            os.remove(name)
+            size -= fileSize
+            with self.lock:
+                self.stats["diskEvictions"] += 1
+
+    def clear(self):
+        """Empties the in-process layer. The on-disk layer is kept."""
+        with self.lock:
+            self.entries.clear()
+
+    def computeTable(self, masses, distances, energiesMuzzle, energiesImpact, classNames, dragCoefficient = 0.477, diameter = 0.006, density = 1.225, dtype = np.float64):
+        """Same as TableEngine.computeTable, served from the cache when possible."""
+        key = tableKey(masses, distances, energiesMuzzle, energiesImpact, dragCoefficient, diameter, density, dtype)
+        muzzleVelocities = self.get(key)
+        if muzzleVelocities is None:
+            result = te.computeTable(masses, distances, energiesMuzzle, energiesImpact, classNames, dragCoefficient, diameter, density, dtype=dtype)
+            self.put(key, result.muzzleVelocities)
+            return result
+        constant = te.dragConstant(dragCoefficient, diameter, density)
+        return SafetyTable.SafetyTable(masses, distances, energiesMuzzle, energiesImpact, classNames, muzzleVelocities, constant)
+
+    def formatPrometheus(self, prefix = "airsoft_table_cache"):
+        """The hit/miss counters in the Prometheus text exposition format."""
+        with self.lock:
+            stats = dict(self.stats)
+            entries = len(self.entries)
+        lines = []
+        for name, metric in [("hits", "hits_total"), ("diskHits", "disk_hits_total"), ("misses", "misses_total"), \
+                             ("evictions", "evictions_total"), ("diskEvictions", "disk_evictions_total")]:
+            lines.append("# TYPE {:s}_{:s} counter".format(prefix, metric))
+            lines.append("{:s}_{:s} {:d}".format(prefix, metric, stats[name]))
+        lines.append("# TYPE {:s}_entries gauge".format(prefix))
+        lines.append("{:s}_entries {:d}".format(prefix, entries))
+        return "\n".join(lines) + "\n"
+
+# ********** Default cache ****************************************************
+# Used by getTable. Replace it to add an on-disk layer, for example
+#   TableCache.defaultCache = TableCache.TableCache(directory="output/cache")
+defaultCache = TableCache()
+
+def cachedComputeTable(masses, distances, energiesMuzzle, energiesImpact, classNames, dragCoefficient = 0.477, diameter = 0.006, density = 1.225, dtype = np.float64):
+    return defaultCache.computeTable(masses, distances, energiesMuzzle, energiesImpact, classNames, dragCoefficient, diameter, density, dtype)
@@ -1,24 +1,26 @@
 import numpy as np
+import Instrumentation
 
 # ********** Energy computation functions *************************************
 def impactEnergyFromMuzzleVelocity(m, x, u, k):
     return m*u*u*0.5*np.exp(-2*k*x/m)
 
+@Instrumentation.stage("compare.impactEnergies")
 def impactEnergyFromMuzzleVelocities(velocitiesMuzzle, masses, distances, constant):
-    energiesImpact = np.zeros(velocitiesMuzzle.shape)
-    for i_class in range(velocitiesMuzzle.shape[0]):
-        for i_mass in range(velocitiesMuzzle.shape[1]):
-            mass = masses[i_mass]
-            distance = distances[i_class]
-            velocityMuzzle = velocitiesMuzzle[i_class, i_mass]
-            energiesImpact[i_class, i_mass] = \
-                impactEnergyFromMuzzleVelocity(mass, distance, velocityMuzzle, constant)
-    return energiesImpact
+    masses = np.asarray(masses).reshape(1, -1)
+    distances = np.asarray(distances).reshape(-1, 1)
+    return impactEnergyFromMuzzleVelocity(masses, distances, velocitiesMuzzle, constant)
 
+@Instrumentation.stage("compare.muzzleEnergies")
 def muzzleEnergyFromMuzzleVelocities(velocitiesMuzzle, masses):
-    distances = np.zeros(velocitiesMuzzle.shape[0])
-    constant = 1
-    return impactEnergyFromMuzzleVelocities(velocitiesMuzzle, masses, distances, constant)
+    masses = np.asarray(masses).reshape(1, -1)
+    return masses*velocitiesMuzzle*velocitiesMuzzle*0.5
+
+def impactEnergyFromMuzzleEnergies(energiesMuzzle, masses, distances, constant):
+    """The impact energies of a table whose muzzle energies are already known."""
+    masses = np.asarray(masses).reshape(1, -1)
+    distances = np.asarray(distances).reshape(-1, 1)
+    return energiesMuzzle*np.exp(-2*constant*distances/masses)
 
 # ********** Comparing functions **********************************************
 """
@@ -41,4 +43,163 @@ def compareMuzzleEnergies(velocitiesMuzzleA, massesA, velocitiesMuzzleB, massesB
 def compareImpactEnergies(velocitiesMuzzleA, massesA, distancesA, velocitiesMuzzleB, massesB, distancesB, constant):
     impactEnergiesA = impactEnergyFromMuzzleVelocities(velocitiesMuzzleA, massesA, distancesA, constant)
     impactEnergiesB = impactEnergyFromMuzzleVelocities(velocitiesMuzzleB, massesB, distancesB, constant)
-    return impactEnergiesB - impactEnergiesA
\ No newline at end of file
+    return impactEnergiesB - impactEnergiesA
+
+# ********** Aligning tables **************************************************
+def alignMasses(velocitiesMuzzle, masses, targetMasses):
+    """
+    Interpolates the columns of a table to other masses. The masses of the
+    table must be sorted. Masses outside the range of the table give NaN,
+    masses on the grid give the table values unchanged.
+
+    The interpolated quantity is v*sqrt(m) = sqrt(2*E), not the velocity: it
+    is constant where the muzzle energy limits the velocity, so those cells
+    are exact. Where the impact energy limits the velocity it is not, and the
+    interpolated velocities and impact energies are only approximate, off by
+    up to about 1 m/s on the VSAF tables and possibly above the impact energy
+    limit of the class. Tables of registered rulesets should rather be
+    computed on the common masses, see
+    AirsoftSafetyTableGenerator.computeRulesetTables.
+    """
+    masses = np.asarray(masses)
+    targetMasses = np.asarray(targetMasses)
+    if masses.size == 1:
+        aligned = np.full((velocitiesMuzzle.shape[0], targetMasses.size), np.nan)
+        aligned[:, targetMasses == masses[0]] = velocitiesMuzzle
+        return aligned
+    upper = np.clip(np.searchsorted(masses, targetMasses), 1, masses.size - 1)
+    lower = upper - 1
+    weight = (targetMasses - masses[lower]) / (masses[upper] - masses[lower])
+    rootEnergies = velocitiesMuzzle * np.sqrt(masses)
+    aligned = (rootEnergies[:, lower] * (1 - weight) + rootEnergies[:, upper] * weight) / np.sqrt(targetMasses)
+    # Exact grid points are copied, so that they are not affected by rounding.
+    exact = masses[lower] == targetMasses
+    aligned[:, exact] = velocitiesMuzzle[:, lower[exact]]
+    aligned[:, (targetMasses < masses[0]) | (targetMasses > masses[-1])] = np.nan
+    return aligned
+
+def interpolatedMasses(masses, targetMasses):
+    """True for the target masses that alignMasses interpolates, those not on the mass axis nor outside it."""
+    masses = np.asarray(masses)
+    targetMasses = np.asarray(targetMasses)
+    return ~np.isin(targetMasses, masses) & (targetMasses >= masses[0]) & (targetMasses <= masses[-1])
+
+def joinDistances(distancesA, distancesB):
+    """
+    Pairs the rows (classes) of two tables by safety distance. Equal distances
+    are paired in order of appearance, so [0, 20, 20] joins [0, 20, 20] row
+    by row.
+
+    Returns the joined distances and the row indices into table A and B.
+    """
+    def occurrences(distances):
+        keys = []
+        count = {}
+        for d in distances:
+            keys.append((d, count.get(d, 0)))
+            count[d] = count.get(d, 0) + 1
+        return keys
+    keysA = occurrences(list(distancesA))
+    keysB = occurrences(list(distancesB))
+    rowsB = {key: i for i, key in enumerate(keysB)}
+    pairs = [(i, rowsB[key]) for i, key in enumerate(keysA) if key in rowsB]
+    rowsA = np.array([a for a, b in pairs], dtype=int)
+    rowsB = np.array([b for a, b in pairs], dtype=int)
+    return np.asarray(distancesA)[rowsA], rowsA, rowsB
+
+class TableComparison:
+    """
+    Two tables aligned on a common mass and distance axis, with their muzzle
+    and impact energies and the differences TableB - TableA. unmatchedA and
+    unmatchedB are the rows of either table that have no pair in the other,
+    interpolatedA and interpolatedB mark the mass columns interpolated in
+    either table (see alignMasses).
+    """
+    __slots__ = ("masses", "distances", "unmatchedA", "unmatchedB", "interpolatedA", "interpolatedB", \
+                 "velocitiesMuzzleA", "velocitiesMuzzleB", "muzzleVelocityDiff", \
+                 "muzzleEnergiesA", "muzzleEnergiesB", "muzzleEnergyDiff", \
+                 "impactEnergiesA", "impactEnergiesB", "impactEnergyDiff")
+
+@Instrumentation.stage("compare.tables")
+def compareTables(massesA, distancesA, velocitiesMuzzleA, massesB, distancesB, velocitiesMuzzleB, constant, constantB = None, masses = None, rows = None):
+    """
+    Compares two tables that need not share the same masses or classes.
+
+    Parameters
+    ----------
+    massesA, distancesA, velocitiesMuzzleA : np.array
+        Table A as returned by getTable. Unit: kg, m, m/s
+    massesB, distancesB, velocitiesMuzzleB : np.array
+        Table B as returned by getTable. Unit: kg, m, m/s
+    constant : float
+        The drag constant of table A. Unit: kg/m
+    constantB : float
+        The drag constant of table B. Default: the same as table A.
+    masses : np.array
+        The masses to compare at. Default: the union of both mass axes,
+        interpolating each table where it lacks a mass, which makes the
+        impact energies of those masses approximate (see alignMasses).
+        Unit: kg
+    rows : (np.array, np.array)
+        The row indices into table A and B of the classes to pair. Default:
+        pair the classes by distance, see joinDistances. The distances of the
+        comparison are those of table B.
+
+    Returns a TableComparison, where cells outside the mass range of either
+    table are NaN.
+    """
+    if constantB is None:
+        constantB = constant
+    if masses is None:
+        masses = np.union1d(massesA, massesB)
+    if rows is None:
+        distances, rowsA, rowsB = joinDistances(distancesA, distancesB)
+    else:
+        rowsA, rowsB = rows
+        distances = np.asarray(distancesB)[rowsB]
+
+    comparison = TableComparison()
+    comparison.masses = masses
+    comparison.distances = distances
+    comparison.unmatchedA = np.setdiff1d(np.arange(len(distancesA)), rowsA)
+    comparison.unmatchedB = np.setdiff1d(np.arange(len(distancesB)), rowsB)
+    comparison.interpolatedA = interpolatedMasses(massesA, masses)
+    comparison.interpolatedB = interpolatedMasses(massesB, masses)
+    comparison.velocitiesMuzzleA = alignMasses(np.asarray(velocitiesMuzzleA)[rowsA], massesA, masses)
+    comparison.velocitiesMuzzleB = alignMasses(np.asarray(velocitiesMuzzleB)[rowsB], massesB, masses)
+    comparison.muzzleEnergiesA = muzzleEnergyFromMuzzleVelocities(comparison.velocitiesMuzzleA, masses)
+    comparison.muzzleEnergiesB = muzzleEnergyFromMuzzleVelocities(comparison.velocitiesMuzzleB, masses)
+    comparison.impactEnergiesA = impactEnergyFromMuzzleEnergies(comparison.muzzleEnergiesA, masses, np.asarray(distancesA)[rowsA], constant)
+    comparison.impactEnergiesB = impactEnergyFromMuzzleEnergies(comparison.muzzleEnergiesB, masses, distances, constantB)
+    comparison.muzzleVelocityDiff = comparison.velocitiesMuzzleB - comparison.velocitiesMuzzleA
+    comparison.muzzleEnergyDiff = comparison.muzzleEnergiesB - comparison.muzzleEnergiesA
+    comparison.impactEnergyDiff = comparison.impactEnergiesB - comparison.impactEnergiesA
+    if Instrumentation.enabled:
+        Instrumentation.count("comparedCells", comparison.muzzleVelocityDiff.size)
+    return comparison
+
+# ********** Report ***********************************************************
+def formatComparison(comparison, labels = ("Old", "New")):
+    """
+    The text report of a TableComparison printed by TableAnalyzer, with
+    labels naming table A and B. Masses are printed in grams. The masses
+    interpolated in a table (see alignMasses) follow as InterpolatedMasses
+    with its label, when there are any.
+    """
+    labelA, labelB = labels
+    interpolated = [("InterpolatedMasses" + label, comparison.masses[columns]*1000, 2) \
+                    for label, columns in [(labelA, comparison.interpolatedA), (labelB, comparison.interpolatedB)] if np.any(columns)]
+    quantities = [("Masses", comparison.masses*1000, 2)] + interpolated + \
+                 [("Distances", comparison.distances, 1), \
+                  ("MuzzleVelocities" + labelA, comparison.velocitiesMuzzleA, 1), \
+                  ("MuzzleVelocities" + labelB, comparison.velocitiesMuzzleB, 1), \
+                  ("MuzzleVelocityDiff", comparison.muzzleVelocityDiff, 1), \
+                  ("MuzzleEnergy" + labelA, comparison.muzzleEnergiesA, 3), \
+                  ("MuzzleEnergy" + labelB, comparison.muzzleEnergiesB, 3), \
+                  ("MuzzleEnergyDiff", comparison.muzzleEnergyDiff, 3), \
+                  ("ImpactEnergy" + labelA, comparison.impactEnergiesA, 3), \
+                  ("ImpactEnergy" + labelB, comparison.impactEnergiesB, 3), \
+                  ("ImpactEnergyDiff", comparison.impactEnergyDiff, 3)]
+    with np.printoptions(linewidth=100, suppress=True):
+        return "".join([name + " " + np.array2string(values, prefix=name + " ", separator=', ', precision=precision) + "\n" \
+                        for name, values, precision in quantities])
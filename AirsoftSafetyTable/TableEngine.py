@@ -0,0 +1,128 @@
+import numpy as np
+import Instrumentation
+import SafetyTable
+
+# ********** Energy computation functions *************************************
+def velocityFromEnergyWithDrag(m, x, E, k):
+    return np.sqrt(2*E/m)*np.exp(k*x/m)
+
+def velocityFromEnergy(m, E):
+    return np.sqrt(2*E/m)
+
+def dragConstant(dragCoefficient = 0.477, diameter = 0.006, density = 1.225):
+    """
+    The constant k = 0.5 * Cd * rho * A of the quadratic drag force F = k*v^2.
+    Unit: kg/m
+    """
+    area = np.pi * (diameter/2)**2 # m^2
+    return 0.5 * dragCoefficient * density * area
+
+def modelConstants(model, dragCoefficient = None, diameter = None, density = None):
+    """
+    Checks the physical constants given together with a physics model: the
+    model computes with its own, so a drag coefficient, diameter or density
+    that differs from the model's raises a ValueError instead of being
+    ignored. None means the model's value.
+    """
+    for name, value in [("dragCoefficient", dragCoefficient), ("diameter", diameter), ("density", density)]:
+        if value is not None and value != getattr(model, name):
+            raise ValueError("{:s} {:s} conflicts with the {:s} {:s} of the model.".format(name, str(value), name, str(getattr(model, name))))
+
+# ********** Table computation ************************************************
+def computeMuzzleVelocities(masses, distances, energiesMuzzle, energiesImpact, constant, out = None, dtype = np.float64):
+    """
+    Computes the maximum allowed muzzle velocity for every class x mass cell
+    in one broadcast, without any Python level loop over the cells.
+
+    Parameters
+    ----------
+    masses : np.array
+        The projectile masses form the columns of the table. Unit: kg.
+    distances : np.array
+        The safety distances form the rows of the table. Unit: m
+    energiesMuzzle : np.array
+        The maximum allowed energy by the muzzle. Unit: J
+    energiesImpact : np.array
+        The maximum allowed energy by the safety distance. Unit: J
+    constant : float or np.array
+        The drag constant, see dragConstant. Unit: kg/m
+        An array of constants gives one table per constant, stacked in front
+        of the class and mass axes.
+    out : np.array
+        Optional preallocated output of shape constant.shape + (distances.size,
+        masses.size) and type dtype. Reusing it avoids one allocation per table.
+    dtype : np.float64 or np.float32
+        Precision of the computation. float64 gives results identical to the
+        per cell computation.
+
+    Returns the table(s) of muzzle velocities (out if given). Unit: m/s
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in (np.dtype(np.float32), np.dtype(np.float64)):
+        raise ValueError("Unsupported dtype {:s}, use float32 or float64.".format(str(dtype)))
+
+    m = np.asarray(masses, dtype=dtype).reshape(1, -1)
+    x = np.asarray(distances, dtype=dtype).reshape(-1, 1)
+    eMuzzle = np.asarray(energiesMuzzle, dtype=dtype).reshape(-1, 1)
+    eImpact = np.asarray(energiesImpact, dtype=dtype).reshape(-1, 1)
+    if eMuzzle.shape[0] != x.shape[0] or eImpact.shape[0] != x.shape[0]:
+        raise ValueError("Number of distances, impact energies and muzzle energies does not match.")
+
+    k = np.asarray(constant, dtype=dtype)
+    shape = k.shape + (x.shape[0], m.shape[1])
+    k = k.reshape(k.shape + (1, 1))
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape or out.dtype != dtype:
+        raise ValueError("Output array must have shape {:s} and type {:s}.".format(str(shape), str(dtype)))
+
+    # Velocity limited by the impact energy at the safety distance,
+    # sqrt(2*E/m)*exp(k*x/m), evaluated in place in out.
+    np.divide(k*x, m, out=out)
+    np.exp(out, out=out)
+    out *= np.sqrt(2*eImpact/m)
+    # Velocity limited by the energy at the muzzle, sqrt(2*E/m).
+    np.minimum(out, np.sqrt(2*eMuzzle/m), out=out)
+    return out
+
+# ********** Table results ****************************************************
+@Instrumentation.stage("computeTable")
+def computeTable(masses, distances, energiesMuzzle, energiesImpact, classNames, dragCoefficient = None, diameter = None, density = None, out = None, dtype = np.float64, model = None):
+    """
+    Computes a safety table without printing or writing anything.
+    The parameters are the same as for getTable, plus the air density
+    (Unit: kg/m^3) and the out and dtype arguments of computeMuzzleVelocities.
+
+    dragCoefficient, diameter and density default to 0.477, 0.006 m and
+    1.225 kg/m^3.
+
+    model is an optional alternative physics model with muzzleVelocityTable
+    and dragConstant methods, for instance TrajectoryModel.TrajectoryModel,
+    which then replaces the straight line, pure drag model. The model has its
+    own drag coefficient, diameter and density: arguments that differ from
+    them raise a ValueError (see modelConstants), and the table gets the drag
+    constant of the model.
+
+    Returns a SafetyTable.SafetyTable. The table takes over the buffer it
+    allocated itself; an out array stays writeable and is copied into the
+    table, so it can be reused for the next table.
+    """
+    if distances.size != len(classNames):
+        raise ValueError("Missmatch between class names ({:d}) and distances ({:d}).".format(len(classNames), distances.size))
+    if model is None:
+        constant = dragConstant(0.477 if dragCoefficient is None else dragCoefficient, \
+                                0.006 if diameter is None else diameter, \
+                                1.225 if density is None else density)
+        muzzleVelocities = computeMuzzleVelocities(masses, distances, energiesMuzzle, energiesImpact, constant, out=out, dtype=dtype)
+    else:
+        modelConstants(model, dragCoefficient, diameter, density)
+        constant = model.dragConstant()
+        muzzleVelocities = model.muzzleVelocityTable(masses, distances, energiesMuzzle, energiesImpact).astype(dtype)
+        if out is not None:
+            out[...] = muzzleVelocities
+            muzzleVelocities = out
+    if Instrumentation.enabled:
+        Instrumentation.count("cells", muzzleVelocities.size)
+    if out is not None:
+        return SafetyTable.SafetyTable(masses, distances, energiesMuzzle, energiesImpact, classNames, muzzleVelocities, constant)
+    return SafetyTable.SafetyTable.fromOwned(masses, distances, energiesMuzzle, energiesImpact, classNames, muzzleVelocities, constant)
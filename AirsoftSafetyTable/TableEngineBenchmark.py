@@ -0,0 +1,51 @@
+import time
+import numpy as np
+import TableEngine as te
+
+# ********** Reference implementation *****************************************
+def loopMuzzleVelocities(masses, distances, energiesMuzzle, energiesImpact, constant):
+    """The per cell implementation getTable used before the vectorized engine."""
+    muzzleVelocities = np.array(np.ones([distances.size, masses.size]))
+    for i_class in range(distances.size):
+        for i_mass in range(masses.size):
+            vFromDrag = te.velocityFromEnergyWithDrag(masses[i_mass], distances[i_class], energiesImpact[i_class], constant)
+            vMuzzleMax = te.velocityFromEnergy(masses[i_mass], energiesMuzzle[i_class])
+            muzzleVelocities[i_class, i_mass] = np.min([vFromDrag, vMuzzleMax])
+    return muzzleVelocities
+
+def syntheticRuleset(nClasses, nMasses):
+    masses = np.linspace(20, 60, nMasses)/100000 # kg
+    distances = np.linspace(0, 40, nClasses) # m
+    energiesMuzzle = np.linspace(1, 4.55, nClasses) # J
+    energiesImpact = np.linspace(1, 1.16, nClasses) # J
+    return masses, distances, energiesMuzzle, energiesImpact
+
+def bestTime(function, repeats):
+    best = np.inf
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# ********** Benchmark ********************************************************
+def runBenchmark(gridSizes = [(7, 12), (10, 100), (100, 1000), (200, 5000), (1000, 10000)], maxLoopCells = 200000, repeats = 3):
+    constant = te.dragConstant()
+    print("{:>7s} {:>7s} {:>12s} {:>12s} {:>12s} {:>9s}".format("classes", "masses", "loop [s]", "f64 [s]", "f32 [s]", "speedup"))
+    for nClasses, nMasses in gridSizes:
+        masses, distances, energiesMuzzle, energiesImpact = syntheticRuleset(nClasses, nMasses)
+        out64 = np.empty([nClasses, nMasses])
+        out32 = np.empty([nClasses, nMasses], dtype=np.float32)
+        time64 = bestTime(lambda: te.computeMuzzleVelocities(masses, distances, energiesMuzzle, energiesImpact, constant, out=out64), repeats)
+        time32 = bestTime(lambda: te.computeMuzzleVelocities(masses, distances, energiesMuzzle, energiesImpact, constant, out=out32, dtype=np.float32), repeats)
+        if nClasses * nMasses <= maxLoopCells:
+            reference = loopMuzzleVelocities(masses, distances, energiesMuzzle, energiesImpact, constant)
+            if not np.array_equal(reference, out64):
+                raise AssertionError("Vectorized table differs from the reference for grid {:d}x{:d}.".format(nClasses, nMasses))
+            timeLoop = bestTime(lambda: loopMuzzleVelocities(masses, distances, energiesMuzzle, energiesImpact, constant), 1)
+            print("{:7d} {:7d} {:12.6f} {:12.6f} {:12.6f} {:8.0f}x".format(nClasses, nMasses, timeLoop, time64, time32, timeLoop / time64))
+        else:
+            print("{:7d} {:7d} {:>12s} {:12.6f} {:12.6f} {:>9s}".format(nClasses, nMasses, "-", time64, time32, "-"))
+
+if __name__ == "__main__":
+    runBenchmark()
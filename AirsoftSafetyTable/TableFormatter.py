@@ -1,4 +1,5 @@
 import numpy as np
+import Instrumentation
 
 # ********** Define functions *************************************************
 def toBold(string):
@@ -10,110 +11,171 @@ def toGram(kg):
 def toms(ms):
     return "{:.1f}".format(ms)
 
-def formatLatexTable(masses, \
-                     distances, \
-                     velocities, \
-                     classNames = ["CQB\t", "Auto A", "Auto B", "Semi", "Bolt A", "Bolt B"], \
-                     outputFile = "table.txt"):
-    separator = "\t&\t"
-    lineEnding = "\t\\\\"
-    newline = "\n"
-    hline = "\\hline\n"
-    headerWords = ["Class", "Safety distance"]
-    # Input validation
+# ********** Streaming formatters *********************************************
+# The table rows are formatted from templates compiled once per table, with
+# one "%.1f" field per mass, and handed out in blocks of rows. This keeps the
+# memory flat in the number of classes and the work linear in the table size.
+
+def validateTable(masses, distances, velocities, classNames):
+    """Returns an error message, or None if the table is consistent."""
     if distances.size != len(classNames):
         return "Missmatch between class names ({:d}) and distances ({:d}).".format(len(classNames), distances.size)
     if velocities.shape[0] != distances.size:
         return "Missmatch between velocities and distances."
     if velocities.shape[1] != masses.size:
         return "Missmatch between velocities and masses."
+    return None
+
+def iterLatexTable(masses, \
+                   distances, \
+                   velocities, \
+                   classNames, \
+                   rowsPerBlock = 256):
+    """Yields the LaTeX table of formatLatexTable in blocks of rows."""
+    separator = "\t&\t"
+    lineEnding = "\t\\\\"
+    newline = "\n"
+    hline = "\\hline\n"
+    headerWords = ["Class", "Safety distance"]
     # Format header
-    first = True
-    header = ""
-    for word in headerWords:
-        header += toBold(word) if first else separator + toBold(word)
-        first = False
-    for mass in masses:
-        header += separator + toBold(toGram(mass))
-    header += lineEnding
+    header = separator.join([toBold(word) for word in headerWords] + [toBold(toGram(mass)) for mass in masses])
+    yield hline + header + lineEnding + newline + hline + hline
     # Format rows
-    rows = [""]*len(classNames)
-    for i_class in range(len(classNames)):
-        rows[i_class] = classNames[i_class] + separator + str(distances[i_class])
-        for vel in velocities[i_class]:
-            rows[i_class] += separator + toms(vel)
-        rows[i_class] += lineEnding
-    # Format final string
-    tableString = hline + header + newline + hline + hline
-    for row in rows:
-        tableString += row + newline + hline
-    # Write result
-    file = open(outputFile, "w")
-    file.write(tableString)
-    file.close()
-    return tableString
+    rowTemplate = "%s" + separator + "%s" + (separator + "%.1f") * masses.size + lineEnding + newline + hline
+    for start in range(0, len(classNames), rowsPerBlock):
+        stop = min(start + rowsPerBlock, len(classNames))
+        yield "".join([rowTemplate % ((classNames[i_class], distances[i_class]) + tuple(velocities[i_class].tolist())) \
+                       for i_class in range(start, stop)])
 
-def formatHtmlTable(masses, \
-                    distances, \
-                    velocities, \
-                    classNames = ["CQB\t", "Auto A", "Auto B", "Semi", "Bolt A", "Bolt B"], \
-                    outputFile = "table.html",
-                    fps = False):
-    lineEnding = "</tr>"
-    newline = "\n"
+def iterHtmlTable(masses, \
+                  distances, \
+                  velocities, \
+                  classNames, \
+                  fps = False, \
+                  rowsPerBlock = 256):
+    """
+    Yields the HTML table of formatHtmlTable in blocks of rows. With fps the
+    velocities are converted row by row, velocities itself is not changed.
+    """
     headerWords = ["Klass", "S-avstånd"]
     rowColors = ['"#EEEEEE"', '"#CCCCCC"']
     mps2fps = 3.28084
-    # Input validation
-    if distances.size != len(classNames):
-        return "Missmatch between class names ({:d}) and distances ({:d}).".format(len(classNames), distances.size)
-    if velocities.shape[0] != distances.size:
-        return "Missmatch between velocities and distances."
-    if velocities.shape[1] != masses.size:
-        return "Missmatch between velocities and masses."
     # Format table start
     tableStart = '<table style="border: 1px solid black; border-collapse: collapse; width: 100%; font-size: 100%;" border="1">\n'
     tableStart += '\t<tbody>\n'
     # Format title
     title = '\t\t<tr bgcolor='+rowColors[1]+'>\n'
     title += '\t\t\t<th style="font-size: 120%" align="left" colspan="' + str(len(masses)+2) + '">VSAF säkerhetstabell för airsoft ('
-    if fps:
-        title += 'fps'
-    else:
-        title += 'm/s'
+    title += 'fps' if fps else 'm/s'
     title += ')</th>\n'
     title += '\t\t</tr>\n'
     # Format header
     header = '\t\t<tr bgcolor='+rowColors[1]+'>\n'
-    for word in headerWords:
-        header += '\t\t\t<th>' + word + '</th>\n'
-    for mass in masses:
-        header += '\t\t\t<th>' + toGram(mass) + 'g</th>\n'
+    header += "".join(['\t\t\t<th>' + word + '</th>\n' for word in headerWords])
+    header += "".join(['\t\t\t<th>' + toGram(mass) + 'g</th>\n' for mass in masses])
     header += '\t\t</tr>\n'
+    yield tableStart + title + header
     # Format rows
-    if (fps):
-        velocities *= mps2fps
-    rows = [""]*len(classNames)
-    for i_class in range(len(classNames)):
-        rows[i_class] = '\t\t<tr bgcolor=' + rowColors[i_class % 2] + '>\n'
-        rows[i_class] += '\t\t\t<td>' + classNames[i_class] + '</td>\n'
-        rows[i_class] += '\t\t\t<td>' + str(distances[i_class]) + 'm</td>\n'
-        for vel in velocities[i_class]:
-            rows[i_class] += '\t\t\t<td>' + toms(vel) + '</td>\n'
-        rows[i_class] += '\t\t</tr>\n'
+    rowTemplate = '\t\t<tr bgcolor=%s>\n' \
+                + '\t\t\t<td>%s</td>\n' \
+                + '\t\t\t<td>%sm</td>\n' \
+                + '\t\t\t<td>%.1f</td>\n' * masses.size \
+                + '\t\t</tr>\n'
+    for start in range(0, len(classNames), rowsPerBlock):
+        stop = min(start + rowsPerBlock, len(classNames))
+        block = velocities[start:stop] * mps2fps if fps else velocities[start:stop]
+        yield "".join([rowTemplate % ((rowColors[i_class % 2], classNames[i_class], distances[i_class]) + tuple(block[i_class - start].tolist())) \
+                       for i_class in range(start, stop)])
     # Format footer
     footer = '\t</tbody>\n'
     footer += '</table>\n'
     footer += '<p> </p>'
+    yield footer
+
+@Instrumentation.stage("write")
+def writeTable(chunks, stream):
+    """
+    Writes the blocks of iterLatexTable or iterHtmlTable to a file-like
+    object. Returns the number of characters written. The instrumentation
+    counts the UTF-8 bytes, as bytesWritten like the file writes.
+    """
+    written = 0
+    bytesWritten = 0
+    for chunk in chunks:
+        stream.write(chunk)
+        written += len(chunk)
+        if Instrumentation.enabled:
+            bytesWritten += len(chunk.encode("utf-8"))
+    if Instrumentation.enabled:
+        Instrumentation.count("bytesWritten", bytesWritten)
+    return written
+
+@Instrumentation.stage("format.latex")
+def writeLatexTable(masses, distances, velocities, classNames, stream):
+    """Streams the LaTeX table to stream, see iterLatexTable."""
+    error = validateTable(masses, distances, velocities, classNames)
+    if error is not None:
+        raise ValueError(error)
+    if Instrumentation.enabled:
+        Instrumentation.count("formattedCells", velocities.size)
+    return writeTable(iterLatexTable(masses, distances, velocities, classNames), stream)
+
+@Instrumentation.stage("format.html")
+def writeHtmlTable(masses, distances, velocities, classNames, stream, fps = False):
+    """Streams the HTML table to stream, see iterHtmlTable."""
+    error = validateTable(masses, distances, velocities, classNames)
+    if error is not None:
+        raise ValueError(error)
+    if Instrumentation.enabled:
+        Instrumentation.count("formattedCells", velocities.size)
+    return writeTable(iterHtmlTable(masses, distances, velocities, classNames, fps), stream)
+
+# ********** Formatters *******************************************************
+@Instrumentation.stage("format.latex")
+def formatLatexTable(masses, \
+                     distances, \
+                     velocities, \
+                     classNames = ["CQB\t", "Auto A", "Auto B", "Semi", "Bolt A", "Bolt B"], \
+                     outputFile = "table.txt"):
+    # Input validation
+    error = validateTable(masses, distances, velocities, classNames)
+    if error is not None:
+        return error
+    # Format final string
+    tableString = "".join(iterLatexTable(masses, distances, velocities, classNames))
+    # Write result
+    if outputFile is not None:
+        file = open(outputFile, "w")
+        file.write(tableString)
+        if Instrumentation.enabled:
+            Instrumentation.count("bytesWritten", file.tell())
+        file.close()
+    if Instrumentation.enabled:
+        Instrumentation.count("formattedCells", velocities.size)
+    return tableString
+
+@Instrumentation.stage("format.html")
+def formatHtmlTable(masses, \
+                    distances, \
+                    velocities, \
+                    classNames = ["CQB\t", "Auto A", "Auto B", "Semi", "Bolt A", "Bolt B"], \
+                    outputFile = "table.html",
+                    fps = False):
+    # Input validation
+    error = validateTable(masses, distances, velocities, classNames)
+    if error is not None:
+        return error
     # Format final string
-    tableString = tableStart + title + header
-    for row in rows:
-        tableString += row
-    tableString += footer
+    tableString = "".join(iterHtmlTable(masses, distances, velocities, classNames, fps))
     # Write result
-    file = open(outputFile, "w")
-    file.write(tableString)
-    file.close()
+    if outputFile is not None:
+        file = open(outputFile, "w")
+        file.write(tableString)
+        if Instrumentation.enabled:
+            Instrumentation.count("bytesWritten", file.tell())
+        file.close()
+    if Instrumentation.enabled:
+        Instrumentation.count("formattedCells", velocities.size)
     return tableString
 
 # ********** Test *************************************************************
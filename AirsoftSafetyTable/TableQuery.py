@@ -0,0 +1,131 @@
+import math
+import numpy as np
+import TableEngine as te
+
+# ********** Lambert W ********************************************************
+def lambertW(z, iterations = 4):
+    """
+    The principal branch W(z) of the Lambert W function, w*exp(w) = z, for
+    z >= 0. Starts from Winitzki's approximation and refines with Halley's
+    method, which reaches double precision in a few iterations.
+    Works on floats and on np.arrays.
+    """
+    z = np.asarray(z, dtype=np.float64)
+    logz = np.log1p(z)
+    w = logz * (1 - np.log1p(logz) / (2 + logz))
+    for i in range(iterations):
+        ew = np.exp(w)
+        f = w*ew - z
+        w = w - f / (ew*(w + 1) - (w + 2)*f / (2*w + 2))
+    return w
+
+def _lambertWScalar(z, iterations = 4):
+    """lambertW for a single float, without the overhead of numpy."""
+    logz = math.log1p(z)
+    w = logz * (1 - math.log1p(logz) / (2 + logz))
+    for i in range(iterations):
+        ew = math.exp(w)
+        f = w*ew - z
+        w = w - f / (ew*(w + 1) - (w + 2)*f / (2*w + 2))
+    return w
+
+# ********** Compiled ruleset *************************************************
+class SafetyQuery:
+    """
+    A ruleset compiled for point lookups, answering both
+
+        maxVelocity: the max muzzle velocity of a mass in a class, and
+        maxMass:     the heaviest mass allowed at a muzzle velocity in a class,
+
+    in closed form for any mass, also masses that are not on a table grid.
+    The drag limited velocity sqrt(2*E/m)*exp(k*x/m) decreases with the mass,
+    so the allowed masses at velocity v are m <= 2*E*exp(W(v^2*k*x/E))/v^2,
+    where W is the Lambert W function, and m <= 2*Emuzzle/v^2.
+
+    Parameters
+    ----------
+    distances, energiesMuzzle, energiesImpact : np.array
+        The ruleset, as for getTable. Unit: m, J, J
+    classNames : str array
+        Names of the classes. Lookups ignore surrounding whitespace and case.
+    constant : float
+        The drag constant, see TableEngine.dragConstant. Unit: kg/m
+    """
+    def __init__(self, distances, energiesMuzzle, energiesImpact, classNames, constant):
+        if distances.size != len(classNames) or energiesMuzzle.size != len(classNames) or energiesImpact.size != len(classNames):
+            raise ValueError("Number of distances, impact energies, muzzle energies and class names does not match.")
+        self.distances = np.asarray(distances, dtype=np.float64)
+        self.energiesMuzzle = np.asarray(energiesMuzzle, dtype=np.float64)
+        self.energiesImpact = np.asarray(energiesImpact, dtype=np.float64)
+        self.classNames = list(classNames)
+        self.constant = float(constant)
+        self.indices = {}
+        for i_class, name in enumerate(self.classNames):
+            self.indices.setdefault(name.strip().lower(), i_class)
+        # Per class floats for the scalar lookups.
+        self.rows = [(float(x), float(eMuzzle), float(eImpact)) for x, eMuzzle, eImpact \
+                     in zip(self.distances, self.energiesMuzzle, self.energiesImpact)]
+
+    @classmethod
+    def fromRuleset(cls, ruleset):
+        """
+        Compiles the getTable keyword arguments of a ruleset, or the name of a
+        registered ruleset (see AirsoftSafetyTableGenerator.getRuleset).
+        """
+        if isinstance(ruleset, str):
+            import AirsoftSafetyTableGenerator
+            ruleset = AirsoftSafetyTableGenerator.getRuleset(ruleset)
+        constant = te.dragConstant(ruleset.get("dragCoefficient", 0.477), ruleset.get("diameter", 0.006), ruleset.get("density", 1.225))
+        return cls(ruleset["distances"], ruleset["energiesMuzzle"], ruleset["energiesImpact"], ruleset["classNames"], constant)
+
+    def classIndex(self, className):
+        """The row of a class, by name or by row index."""
+        if isinstance(className, (int, np.integer)):
+            return int(className)
+        try:
+            return self.indices[className.strip().lower()]
+        except KeyError:
+            raise KeyError("Unknown class {:s}.".format(repr(className)))
+
+    def classIndices(self, classNames, missing = None):
+        """
+        classIndex for an array of class names, looking up every distinct name
+        once. Unknown names raise a KeyError, or map to missing if given.
+        """
+        classNames = np.asarray(classNames)
+        if classNames.dtype.kind in "iu":
+            return classNames.astype(int)
+        names, inverse = np.unique(classNames.astype(str), return_inverse=True)
+        if missing is None:
+            rows = [self.classIndex(name) for name in names]
+        else:
+            rows = [self.indices.get(name.strip().lower(), missing) for name in names]
+        return np.array(rows, dtype=int)[inverse].reshape(classNames.shape)
+
+    # ********** Point queries ************************************************
+    def maxVelocity(self, className, mass):
+        """Max muzzle velocity of mass (Unit: kg) in a class. Unit: m/s"""
+        x, eMuzzle, eImpact = self.rows[self.classIndex(className)]
+        return min(math.sqrt(2*eImpact/mass)*math.exp(self.constant*x/mass), math.sqrt(2*eMuzzle/mass))
+
+    def maxMass(self, className, velocity):
+        """Heaviest mass allowed at a muzzle velocity (Unit: m/s) in a class. Unit: kg"""
+        x, eMuzzle, eImpact = self.rows[self.classIndex(className)]
+        w = _lambertWScalar(velocity*velocity*self.constant*x/eImpact)
+        return 2*min(eMuzzle, eImpact*math.exp(w))/(velocity*velocity)
+
+    # ********** Batched queries **********************************************
+    def maxVelocities(self, classNames, masses):
+        """maxVelocity for arrays of classes (names or indices) and masses."""
+        rows = self.classIndices(classNames)
+        masses = np.asarray(masses, dtype=np.float64)
+        return np.minimum(te.velocityFromEnergyWithDrag(masses, self.distances[rows], self.energiesImpact[rows], self.constant), \
+                          te.velocityFromEnergy(masses, self.energiesMuzzle[rows]))
+
+    def maxMasses(self, classNames, velocities):
+        """maxMass for arrays of classes (names or indices) and velocities."""
+        rows = self.classIndices(classNames)
+        velocities = np.asarray(velocities, dtype=np.float64)
+        eImpact = self.energiesImpact[rows]
+        w = lambertW(velocities*velocities*self.constant*self.distances[rows]/eImpact)
+        return 2*np.minimum(self.energiesMuzzle[rows], eImpact*np.exp(w))/(velocities*velocities)
@@ -0,0 +1,372 @@
+import os
+import numpy as np
+import AirsoftSafetyTableGenerator
+import SafetyTable
+import TableComparator
+import TableEngine as te
+import TableFormatter as tf
+
+# ********** Incremental documents ********************************************
+# A formatted table is a header, one string per class and a footer. The
+# document remembers where every row went in its file, so that rows that
+# changed but kept their length are patched in place.
+
+class _Document:
+    __slots__ = ("header", "rows", "footer", "fileName", "rowOffsets", "rowSizes", "changedRows", "rewrite")
+
+    def __init__(self, fileName):
+        self.header = ""
+        self.rows = []
+        self.footer = ""
+        self.fileName = fileName
+        self.rowOffsets = None
+        self.rowSizes = None
+        self.changedRows = set()
+        self.rewrite = True
+
+    def text(self):
+        return self.header + "".join(self.rows) + self.footer
+
+    def write(self):
+        """Writes the document, patching the changed rows only when possible. Returns the number of bytes written."""
+        if self.fileName is None:
+            return 0
+        patch = not self.rewrite and os.path.exists(self.fileName)
+        if patch:
+            changed = sorted(self.changedRows)
+            encoded = [self.rows[i_row].encode("utf-8") for i_row in changed]
+            patch = all(len(row) == self.rowSizes[i_row] for i_row, row in zip(changed, encoded))
+        if patch:
+            with open(self.fileName, "r+b") as file:
+                for i_row, row in zip(changed, encoded):
+                    file.seek(self.rowOffsets[i_row])
+                    file.write(row)
+            written = sum(len(row) for row in encoded)
+        else:
+            header = self.header.encode("utf-8")
+            rows = [row.encode("utf-8") for row in self.rows]
+            self.rowSizes = np.array([len(row) for row in rows], dtype=np.int64)
+            self.rowOffsets = len(header) + np.concatenate([[0], np.cumsum(self.rowSizes)[:-1]]).astype(np.int64)
+            with open(self.fileName, "wb") as file:
+                file.write(header)
+                file.writelines(rows)
+                file.write(self.footer.encode("utf-8"))
+            written = len(header) + int(self.rowSizes.sum()) + len(self.footer.encode("utf-8"))
+        self.changedRows = set()
+        self.rewrite = False
+        return written
+
+# ********** Table session ****************************************************
+class TableSession:
+    """
+    An editable safety table for iterative ruleset tuning. Every cell depends
+    only on its class (distance and energies) and its mass, so an edit marks
+    a row or a column dirty and update() recomputes and formats those cells
+    only. The LaTeX and HTML outputs are kept as one string per row and are
+    patched in their files.
+
+    Parameters
+    ----------
+    ruleset : dict or str
+        The starting ruleset, as keyword arguments of getTable or the name of
+        a registered ruleset (see AirsoftSafetyTableGenerator.getRuleset).
+    latexFile, htmlFile : str
+        Output files written by write(), None skips the format.
+    fps : bool
+        Print the HTML velocities in fps instead of m/s.
+
+    The outputs are identical to formatLatexTable and formatHtmlTable of the
+    same table.
+    """
+    def __init__(self, ruleset, latexFile = "output/latexTable.txt", htmlFile = "output/htmlTable.html", fps = False):
+        ruleset = AirsoftSafetyTableGenerator.getRuleset(ruleset) if isinstance(ruleset, str) else dict(ruleset)
+        self.masses = np.array(ruleset["masses"], dtype=np.float64)
+        self.distances = np.array(ruleset["distances"])
+        self.energiesMuzzle = np.array(ruleset["energiesMuzzle"], dtype=np.float64)
+        self.energiesImpact = np.array(ruleset["energiesImpact"], dtype=np.float64)
+        self.classNames = list(ruleset["classNames"])
+        if self.distances.size != len(self.classNames):
+            raise ValueError("Missmatch between class names ({:d}) and distances ({:d}).".format(len(self.classNames), self.distances.size))
+        self.dragCoefficient = ruleset.get("dragCoefficient", 0.477)
+        self.diameter = ruleset.get("diameter", 0.006)
+        self.density = ruleset.get("density", 1.225)
+        self.constant = te.dragConstant(self.dragCoefficient, self.diameter, self.density)
+        self.fps = fps
+        self.velocities = np.empty((self.distances.size, self.masses.size))
+        self.cells = np.empty((self.distances.size, self.masses.size), dtype=object)
+        self.cellsHtml = self.cells if not fps else np.empty((self.distances.size, self.masses.size), dtype=object)
+        self.latex = _Document(latexFile)
+        self.html = _Document(htmlFile)
+        self.latex.rows = [""] * self.distances.size
+        self.html.rows = [""] * self.distances.size
+        # Every class keeps its id through edits, diff() pairs classes by id.
+        self.rowIds = list(range(self.distances.size))
+        self.nextRowId = self.distances.size
+        # Dirty rows and columns need computing, restyled rows only joining.
+        self.dirtyRows = set(range(self.distances.size))
+        self.dirtyColumns = set()
+        self.restyledRows = set()
+        self.headerChanged = True
+        self.previous = None
+        self.current = None
+        self.previousIds = None
+        self.currentIds = None
+        self.update()
+
+    # ********** Edits ********************************************************
+    def classIndex(self, className):
+        try:
+            return self.classNames.index(className)
+        except ValueError:
+            raise KeyError(className) from None
+
+    def setClass(self, className, distance = None, energyMuzzle = None, energyImpact = None, name = None):
+        """Changes the safety distance (Unit: m), energies (Unit: J) or name of a class."""
+        i_class = self.classIndex(className)
+        if distance is not None:
+            self._fitDistance(distance)
+            self.distances[i_class] = distance
+        if energyMuzzle is not None:
+            self.energiesMuzzle[i_class] = energyMuzzle
+        if energyImpact is not None:
+            self.energiesImpact[i_class] = energyImpact
+        if name is not None:
+            self.classNames[i_class] = name
+        self.dirtyRows.add(i_class)
+
+    def addClass(self, className, distance, energyMuzzle, energyImpact, index = None):
+        """Inserts a class before index, default last."""
+        index = len(self.classNames) if index is None else index
+        self._fitDistance(distance)
+        self.distances = np.insert(self.distances, index, distance)
+        self.energiesMuzzle = np.insert(self.energiesMuzzle, index, energyMuzzle)
+        self.energiesImpact = np.insert(self.energiesImpact, index, energyImpact)
+        self.classNames.insert(index, className)
+        self.velocities = np.insert(self.velocities, index, np.nan, axis=0)
+        self.cells = np.insert(self.cells, index, None, axis=0)
+        self.cellsHtml = self.cells if not self.fps else np.insert(self.cellsHtml, index, None, axis=0)
+        self.rowIds.insert(index, self.nextRowId)
+        self.nextRowId += 1
+        self._shiftRows(index, 1)
+        self.dirtyRows.add(index)
+        for document in [self.latex, self.html]:
+            document.rows.insert(index, "")
+            document.changedRows = set()
+            document.rewrite = True
+        # The HTML row colors alternate, every later row changes color.
+        self.restyledRows.update(range(index + 1, len(self.classNames)))
+
+    def removeClass(self, className):
+        index = self.classIndex(className)
+        self.distances = np.delete(self.distances, index)
+        self.energiesMuzzle = np.delete(self.energiesMuzzle, index)
+        self.energiesImpact = np.delete(self.energiesImpact, index)
+        del self.classNames[index]
+        del self.rowIds[index]
+        self.velocities = np.delete(self.velocities, index, axis=0)
+        self.cells = np.delete(self.cells, index, axis=0)
+        self.cellsHtml = self.cells if not self.fps else np.delete(self.cellsHtml, index, axis=0)
+        self.dirtyRows.discard(index)
+        self.restyledRows.discard(index)
+        self._shiftRows(index + 1, -1)
+        for document in [self.latex, self.html]:
+            del document.rows[index]
+            # The row positions moved, the whole file is written again.
+            document.changedRows = set()
+            document.rewrite = True
+        self.restyledRows.update(range(index, len(self.classNames)))
+
+    def _fitDistance(self, distance):
+        # Integer distances print without decimals, a fractional one turns
+        # them all to floats and so changes every row.
+        if self.distances.dtype.kind in "iu" and distance != int(distance):
+            self.distances = self.distances.astype(np.float64)
+            self.restyledRows.update(range(len(self.classNames)))
+
+    def _shiftRows(self, start, shift):
+        self.dirtyRows = set(i + shift if i >= start else i for i in self.dirtyRows)
+        self.restyledRows = set(i + shift if i >= start else i for i in self.restyledRows)
+
+    def addMass(self, mass):
+        """Adds a mass column (Unit: kg), keeping the masses sorted."""
+        index = int(np.searchsorted(self.masses, mass))
+        self.masses = np.insert(self.masses, index, mass)
+        self.velocities = np.insert(self.velocities, index, np.nan, axis=1)
+        self.cells = np.insert(self.cells, index, None, axis=1)
+        self.cellsHtml = self.cells if not self.fps else np.insert(self.cellsHtml, index, None, axis=1)
+        self.dirtyColumns = set(i + 1 if i >= index else i for i in self.dirtyColumns)
+        self.dirtyColumns.add(index)
+        self.headerChanged = True
+
+    def removeMass(self, mass):
+        index = int(np.searchsorted(self.masses, mass))
+        if index >= self.masses.size or not np.isclose(self.masses[index], mass, rtol=1e-9, atol=0):
+            raise KeyError(mass)
+        self.masses = np.delete(self.masses, index)
+        self.velocities = np.delete(self.velocities, index, axis=1)
+        self.cells = np.delete(self.cells, index, axis=1)
+        self.cellsHtml = self.cells if not self.fps else np.delete(self.cellsHtml, index, axis=1)
+        self.dirtyColumns.discard(index)
+        self.dirtyColumns = set(i - 1 if i > index else i for i in self.dirtyColumns)
+        self.headerChanged = True
+        # Every row loses a cell, but none needs computing.
+        self.restyledRows.update(range(len(self.classNames)))
+
+    def setConstants(self, dragCoefficient = None, diameter = None, density = None):
+        """Changes the physical constants, which every cell depends on."""
+        self.dragCoefficient = self.dragCoefficient if dragCoefficient is None else dragCoefficient
+        self.diameter = self.diameter if diameter is None else diameter
+        self.density = self.density if density is None else density
+        self.constant = te.dragConstant(self.dragCoefficient, self.diameter, self.density)
+        self.dirtyRows = set(range(len(self.classNames)))
+
+    # ********** Update *******************************************************
+    def _formatCells(self, rows, columns):
+        """Formats the velocities of the cells rows x columns, as iterLatexTable and iterHtmlTable do."""
+        values = self.velocities[np.ix_(rows, columns)]
+        self.cells[np.ix_(rows, columns)] = np.array(["%.1f" % value for value in values.reshape(-1).tolist()], dtype=object).reshape(values.shape)
+        if self.fps:
+            valuesFps = values * SafetyTable.mps2fps
+            self.cellsHtml[np.ix_(rows, columns)] = np.array(["%.1f" % value for value in valuesFps.reshape(-1).tolist()], dtype=object).reshape(values.shape)
+
+    def update(self):
+        """
+        Recomputes the dirty cells and formats the changed rows. Returns the
+        new version of the table as a SafetyTable, the one before is kept for
+        diff().
+        """
+        rows = sorted(self.dirtyRows)
+        columns = sorted(self.dirtyColumns)
+        allRows = list(range(len(self.classNames)))
+        allColumns = list(range(self.masses.size))
+        if len(rows) > 0:
+            self.velocities[rows] = te.computeMuzzleVelocities(self.masses, self.distances[rows], self.energiesMuzzle[rows], self.energiesImpact[rows], self.constant)
+            self._formatCells(rows, allColumns)
+        if len(columns) > 0:
+            self.velocities[:, columns] = te.computeMuzzleVelocities(self.masses[columns], self.distances, self.energiesMuzzle, self.energiesImpact, self.constant)
+            self._formatCells(allRows, columns)
+
+        # A new column changes every row, but only its cell needed formatting.
+        joinRows = allRows if len(columns) > 0 else sorted(self.dirtyRows | self.restyledRows)
+        separator = "\t&\t"
+        rowEnding = "\t\\\\" + "\n" + "\\hline\n"
+        rowColors = ['"#EEEEEE"', '"#CCCCCC"']
+        for i_class in joinRows:
+            name = self.classNames[i_class]
+            distance = "%s" % self.distances[i_class]
+            self.latex.rows[i_class] = name + separator + distance + "".join([separator + cell for cell in self.cells[i_class]]) + rowEnding
+            self.html.rows[i_class] = '\t\t<tr bgcolor=' + rowColors[i_class % 2] + '>\n' \
+                                    + '\t\t\t<td>' + name + '</td>\n' \
+                                    + '\t\t\t<td>' + distance + 'm</td>\n' \
+                                    + "".join(['\t\t\t<td>' + cell + '</td>\n' for cell in self.cellsHtml[i_class]]) \
+                                    + '\t\t</tr>\n'
+        for document in [self.latex, self.html]:
+            document.changedRows.update(joinRows)
+
+        if self.headerChanged:
+            emptyRows = np.empty((0, self.masses.size))
+            self.latex.header = next(tf.iterLatexTable(self.masses, self.distances[:0], emptyRows, []))
+            self.html.header, self.html.footer = list(tf.iterHtmlTable(self.masses, self.distances[:0], emptyRows, [], self.fps))
+            self.latex.rewrite = True
+            self.html.rewrite = True
+
+        self.dirtyRows = set()
+        self.dirtyColumns = set()
+        self.restyledRows = set()
+        self.headerChanged = False
+        self.previous = self.current
+        self.previousIds = self.currentIds
+        self.currentIds = list(self.rowIds)
+        self.current = SafetyTable.SafetyTable(self.masses, self.distances, self.energiesMuzzle, self.energiesImpact, \
+                                               self.classNames, self.velocities, self.constant)
+        return self.current
+
+    # ********** Outputs ******************************************************
+    def latexTable(self):
+        """The LaTeX table, as formatLatexTable."""
+        return self.latex.text()
+
+    def htmlTable(self):
+        """The HTML table, as formatHtmlTable."""
+        return self.html.text()
+
+    def write(self):
+        """Writes the changes to latexFile and htmlFile. Returns the number of bytes written."""
+        return self.latex.write() + self.html.write()
+
+    def diff(self):
+        """
+        The TableComparison of the previous version (A) and the current one
+        (B), None before the first edit. Classes are paired by identity, not
+        by distance, so a class keeps its pair when its distance or name
+        changes. Added and removed classes are the unmatched rows of the
+        comparison (unmatchedB and unmatchedA).
+        """
+        if self.previous is None:
+            return None
+        previousRows = {rowId: i_class for i_class, rowId in enumerate(self.previousIds)}
+        pairs = [(previousRows[rowId], i_class) for i_class, rowId in enumerate(self.currentIds) if rowId in previousRows]
+        rows = (np.array([a for a, b in pairs], dtype=int), np.array([b for a, b in pairs], dtype=int))
+        return TableComparator.compareTables(self.previous.masses, self.previous.distances, self.previous.muzzleVelocities, \
+                                             self.current.masses, self.current.distances, self.current.muzzleVelocities, \
+                                             self.previous.constant, self.current.constant, rows = rows)
+
+    def formatDiff(self):
+        """The diff as the TableAnalyzer report, followed by the removed and added classes."""
+        comparison = self.diff()
+        if comparison is None:
+            return ""
+        report = TableComparator.formatComparison(comparison)
+        removed = [self.previous.classNames[i_class] for i_class in comparison.unmatchedA]
+        added = [self.current.classNames[i_class] for i_class in comparison.unmatchedB]
+        if len(removed) > 0:
+            report += "Removed classes: " + ", ".join([name.strip() for name in removed]) + "\n"
+        if len(added) > 0:
+            report += "Added classes: " + ", ".join([name.strip() for name in added]) + "\n"
+        return report
+
+# ********** Test *************************************************************
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        latexFile = os.path.join(directory, "latexTable.txt")
+        htmlFile = os.path.join(directory, "htmlTable.html")
+        def checkFiles(session):
+            table = session.current
+            with open(latexFile, "r") as file:
+                assert file.read() == tf.formatLatexTable(table.masses, table.distances, table.muzzleVelocities, list(table.classNames), None)
+            with open(htmlFile, "r") as file:
+                assert file.read() == tf.formatHtmlTable(table.masses, table.distances, table.muzzleVelocities, list(table.classNames), None)
+
+        # Inserting or removing a class after an update that was not written.
+        session = TableSession("vsaf2020", latexFile, htmlFile)
+        session.write()
+        session.setClass("BoltB", energyMuzzle=4.0)
+        session.update()
+        session.removeClass("CQB\t")
+        session.update()
+        session.write()
+        checkFiles(session)
+        session.setClass("Semi", energyMuzzle=2.6)
+        session.update()
+        session.addClass("HMG2", 20, 2.11, 1.08, index=3)
+        session.update()
+        session.write()
+        checkFiles(session)
+
+        # Classes are paired by identity in the diff.
+        session = TableSession("vsaf2020", latexFile, htmlFile)
+        session.setClass("AutoA", distance=7)
+        session.update()
+        comparison = session.diff()
+        assert comparison.distances.size == 7 and comparison.distances[1] == 7
+        assert comparison.unmatchedA.size == 0 and comparison.unmatchedB.size == 0
+        assert np.any(comparison.muzzleVelocityDiff[1] != 0)
+        session.addClass("HMG2", 20, 2.11, 1.08, index=3)
+        session.removeClass("BoltB")
+        session.update()
+        comparison = session.diff()
+        assert np.all(comparison.muzzleVelocityDiff == 0)
+        assert list(comparison.unmatchedA) == [6] and list(comparison.unmatchedB) == [3]
+        assert session.formatDiff().endswith("Removed classes: BoltB\nAdded classes: HMG2\n")
+    print("TableSession ok")
@@ -0,0 +1,144 @@
+import atexit
+import queue
+import threading
+import numpy as np
+import Instrumentation
+import TableFormatter as tf
+
+# ********** Sinks ************************************************************
+# A sink receives SafetyTables from computeTable through write() and produces
+# its artifacts on flush(). Sinks can be used as context managers, in which
+# case they are flushed and closed when the batch ends:
+#
+#   with DeferredSink(FileSink()) as sink:
+#       for ruleset in rulesets:
+#           sink.write(te.computeTable(*ruleset))
+
+class NullSink:
+    """Discards all tables, for callers that only want the numbers."""
+    def write(self, result):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Releases what the sink holds, after a last flush where needed."""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        try:
+            self.flush()
+        finally:
+            self.close()
+
+class FileSink(NullSink):
+    """
+    Collects the LaTeX and HTML formatting of every table written to it and
+    writes each artifact once, when flushed. A single table gives the same
+    files as getTable always has.
+
+    Parameters
+    ----------
+    latexFile : str
+        Output file of the LaTeX tables, or None to skip LaTeX.
+    htmlFile : str
+        Output file of the HTML tables, or None to skip HTML.
+    fps : bool
+        Print the HTML velocities in fps instead of m/s.
+    printTables : bool
+        Print every table to stdout when it is written.
+    """
+    def __init__(self, latexFile = "output/latexTable.txt", htmlFile = "output/htmlTable.html", fps = False, printTables = False):
+        self.latexFile = latexFile
+        self.htmlFile = htmlFile
+        self.fps = fps
+        self.printTables = printTables
+        self.latexTables = []
+        self.htmlTables = []
+
+    def write(self, result):
+        if self.printTables:
+            print(np.array2string(result.muzzleVelocities, max_line_width=100, precision=1))
+        if self.latexFile is not None:
+            self.latexTables.append(tf.formatLatexTable(result.masses, result.distances, result.muzzleVelocities, result.classNames, None))
+        if self.htmlFile is not None:
+            self.htmlTables.append(tf.formatHtmlTable(result.masses, result.distances, result.muzzleVelocities, result.classNames, None, self.fps))
+
+    @Instrumentation.stage("sink.flush")
+    def flush(self):
+        for fileName, tables in [(self.latexFile, self.latexTables), (self.htmlFile, self.htmlTables)]:
+            if fileName is not None and len(tables) > 0:
+                file = open(fileName, "w")
+                file.write("\n".join(tables))
+                if Instrumentation.enabled:
+                    Instrumentation.count("bytesWritten", file.tell())
+                file.close()
+        self.latexTables = []
+        self.htmlTables = []
+
+# Stops the thread of a DeferredSink.
+_stop = object()
+
+class DeferredSink(NullSink):
+    """
+    Hands the tables to another sink on a background thread, so that the
+    formatting and the file writes overlap with the computation of the next
+    tables. flush() waits until everything written so far has been handled
+    and then flushes the wrapped sink. close() flushes and stops the thread,
+    use the sink in a with statement or close it. A sink that is still open
+    at interpreter exit is closed then, so no write is lost.
+    """
+    def __init__(self, sink):
+        self.sink = sink
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            result = self.queue.get()
+            try:
+                if result is _stop:
+                    return
+                if result is None:
+                    self.sink.flush()
+                else:
+                    self.sink.write(result)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def write(self, result):
+        if self.thread is None:
+            raise ValueError("The DeferredSink is closed.")
+        self.queue.put(result)
+
+    def flush(self):
+        if self.thread is None:
+            return
+        # None marks a flush of the wrapped sink.
+        self.queue.put(None)
+        self.queue.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        """Flushes, stops and joins the background thread and closes the wrapped sink."""
+        if self.thread is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self.queue.put(_stop)
+            self.thread.join()
+            self.thread = None
+            atexit.unregister(self.close)
+            self.sink.close()
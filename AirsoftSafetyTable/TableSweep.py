@@ -0,0 +1,116 @@
+import numpy as np
+import concurrent.futures
+import TableEngine as te
+
+# ********** Air density ******************************************************
+def airDensity(temperature = 15, altitude = 0):
+    """
+    Density of dry air in the standard atmosphere.
+
+    Parameters
+    ----------
+    temperature : float or np.array
+        The air temperature. Unit: degC
+    altitude : float or np.array
+        The altitude above sea level, giving the pressure through the
+        barometric formula. Unit: m
+
+    Returns the air density. Unit: kg/m^3 (1.225 at 15 degC, 0 m)
+    """
+    pressure = 101325 * (1 - 2.25577e-5 * np.asarray(altitude))**5.25588 # Pa
+    specificGasConstant = 287.05 # J/(kg K)
+    return pressure / (specificGasConstant * (np.asarray(temperature) + 273.15))
+
+# ********** Parameter sweep **************************************************
+def _sweepChunk(masses, distances, energiesMuzzle, energiesImpact, constants, dtype):
+    return te.computeMuzzleVelocities(masses, distances, energiesMuzzle, energiesImpact, constants, dtype=dtype)
+
+def sweepMuzzleVelocities(masses, \
+                          distances, \
+                          energiesMuzzle, \
+                          energiesImpact, \
+                          dragCoefficients = [0.477], \
+                          diameters = [0.006], \
+                          densities = [1.225], \
+                          maxChunkCells = 2**22, \
+                          processes = 1, \
+                          out = None, \
+                          dtype = np.float64):
+    """
+    Computes the safety table for every combination of drag coefficient,
+    diameter and air density in one vectorized pass per chunk.
+
+    Parameters
+    ----------
+    masses, distances, energiesMuzzle, energiesImpact : np.array
+        The ruleset, as for getTable. Unit: kg, m, J, J
+    dragCoefficients : np.array
+        The drag coefficients to sweep. Unit: unitless
+    diameters : np.array
+        The projectile diameters to sweep. Unit: m
+    densities : np.array
+        The air densities to sweep, see airDensity. Unit: kg/m^3
+    maxChunkCells : int
+        Upper bound on the number of table cells computed at once, which
+        bounds the memory of the temporaries.
+    processes : int
+        Number of worker processes the chunks are spread over. 1 computes
+        everything in the calling process.
+    out : np.array
+        Optional preallocated output (for instance a np.memmap).
+    dtype : np.float64 or np.float32
+        Precision of the computation.
+
+    Returns the muzzle velocities with shape (dragCoefficients.size,
+    diameters.size, densities.size, distances.size, masses.size). Unit: m/s
+    """
+    dragCoefficients = np.atleast_1d(np.asarray(dragCoefficients, dtype=np.float64))
+    diameters = np.atleast_1d(np.asarray(diameters, dtype=np.float64))
+    densities = np.atleast_1d(np.asarray(densities, dtype=np.float64))
+    constants = te.dragConstant(dragCoefficients[:, np.newaxis, np.newaxis], \
+                                diameters[np.newaxis, :, np.newaxis], \
+                                densities[np.newaxis, np.newaxis, :])
+    return computeTables(masses, distances, energiesMuzzle, energiesImpact, constants, maxChunkCells, processes, out, dtype)
+
+def computeTables(masses, \
+                  distances, \
+                  energiesMuzzle, \
+                  energiesImpact, \
+                  constants, \
+                  maxChunkCells = 2**22, \
+                  processes = 1, \
+                  out = None, \
+                  dtype = np.float64):
+    """
+    Computes one table per drag constant (Unit: kg/m), in chunks of whole
+    tables, optionally spread over worker processes. The other parameters
+    are the same as for sweepMuzzleVelocities.
+
+    Returns the muzzle velocities with shape constants.shape + (distances.size,
+    masses.size). Unit: m/s
+    """
+    constants = np.asarray(constants, dtype=np.float64)
+    tableShape = (distances.size, masses.size)
+    shape = constants.shape + tableShape
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape or out.dtype != np.dtype(dtype) or not out.flags.c_contiguous:
+        raise ValueError("Output array must be C contiguous with shape {:s} and type {:s}.".format(str(shape), str(np.dtype(dtype))))
+
+    # Split the flattened constants into chunks of whole tables.
+    flatConstants = constants.reshape(-1)
+    flatOut = out.reshape((-1,) + tableShape)
+    tablesPerChunk = max(1, maxChunkCells // max(1, distances.size * masses.size))
+    chunks = [slice(start, min(start + tablesPerChunk, flatConstants.size)) \
+              for start in range(0, flatConstants.size, tablesPerChunk)]
+
+    if processes <= 1 or len(chunks) == 1:
+        for chunk in chunks:
+            te.computeMuzzleVelocities(masses, distances, energiesMuzzle, energiesImpact, flatConstants[chunk], out=flatOut[chunk], dtype=dtype)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {executor.submit(_sweepChunk, masses, distances, energiesMuzzle, energiesImpact, flatConstants[chunk], dtype): chunk \
+                       for chunk in chunks}
+            for future in concurrent.futures.as_completed(futures):
+                flatOut[futures[future]] = future.result()
+    return out
@@ -0,0 +1,227 @@
+import collections
+import numpy as np
+import TableEngine as te
+
+# ********** Trajectory model *************************************************
+class TrajectoryModel:
+    """
+    Flight of a BB in the vertical plane with quadratic drag, gravity and
+    hop-up (Magnus) lift, as an alternative to the straight line, pure drag
+    model exp(-2*k*x/m) of getTable.
+
+    The equations of motion are integrated over the downrange distance x with
+    a fixed step fourth order Runge-Kutta method, for whole batches of
+    (mass, muzzle velocity) pairs at once:
+
+        dy/dx  = vy/vx
+        dvx/dx = (-kd*v*vx - kl*v*vy)/(m*vx)
+        dvy/dx = (-kd*v*vy + kl*v*vx)/(m*vx) - g/vx
+
+    with kd = 0.5*rho*Cd(v)*A and kl = 0.5*rho*Cl*A.
+
+    With gravity = 0, no lift and a constant Cd the flight is a straight line
+    and muzzleVelocityTable reproduces the exponential model of getTable to
+    about 1e-9 m/s. With the default gravity of 9.81 m/s^2 the BB drops and
+    flies a longer, slower path, so its table is lower by up to about 0.1 m/s
+    for the vsaf2020 ruleset.
+
+    Parameters
+    ----------
+    dragCoefficient : float or function
+        The drag coefficient, or a function of the velocity (Unit: m/s)
+        returning it, for a velocity dependent Cd. Default value: 0.477
+    diameter : float
+        The BB diameter. Unit: m. Default value: 0.006
+    density : float
+        The air density. Unit: kg/m^3. Default value: 1.225
+    liftCoefficient : float
+        The lift coefficient of the hop-up backspin. Default value: 0 (no hop-up)
+    gravity : float
+        Unit: m/s^2. Default value: 9.81
+    angle : float
+        Launch angle above the horizon. Unit: rad. Default value: 0
+    step : float
+        Integration step. Unit: m. Default value: 0.25
+    velocitySamples : int
+        Number of muzzle velocities per mass of the lookup table of
+        muzzleVelocityTable.
+    maxLookupTables : int
+        Number of lookup tables kept for later tables, each one holds
+        masses x velocitySamples x distances speeds. Default value: 4
+    """
+    def __init__(self, dragCoefficient = 0.477, diameter = 0.006, density = 1.225, liftCoefficient = 0.0, gravity = 9.81, \
+                 angle = 0.0, step = 0.25, velocitySamples = 256, maxLookupTables = 4):
+        self.dragCoefficient = dragCoefficient
+        self.diameter = diameter
+        self.density = density
+        self.liftCoefficient = liftCoefficient
+        self.gravity = gravity
+        self.angle = angle
+        self.step = step
+        self.velocitySamples = velocitySamples
+        self.maxLookupTables = maxLookupTables
+        self.lookupTables = collections.OrderedDict()
+
+    def _derivatives(self, masses, state):
+        y, vx, vy = state
+        v = np.sqrt(vx*vx + vy*vy)
+        area = np.pi * (self.diameter/2)**2 # m^2
+        dragCoefficient = self.dragCoefficient(v) if callable(self.dragCoefficient) else self.dragCoefficient
+        drag = 0.5 * self.density * dragCoefficient * area * v / masses
+        lift = 0.5 * self.density * self.liftCoefficient * area * v / masses
+        return np.array([vy / vx, \
+                         -drag - lift * vy / vx, \
+                         -drag * vy / vx + lift - self.gravity / vx])
+
+    def integrate(self, masses, muzzleVelocities, distances, withHeights = True):
+        """
+        Integrates every (mass, muzzle velocity) pair of the broadcast arrays
+        masses (Unit: kg) and muzzleVelocities (Unit: m/s) up to the largest
+        of distances (Unit: m).
+
+        Returns the speed (Unit: m/s) and height (Unit: m) at every distance,
+        with shape masses/muzzleVelocities broadcast + (distances.size,).
+        Trajectories that stall (fall vertically) before a distance are NaN
+        from there on. Without withHeights the heights are not kept and None
+        is returned for them.
+        """
+        masses, muzzleVelocities = np.broadcast_arrays(np.asarray(masses, dtype=np.float64), np.asarray(muzzleVelocities, dtype=np.float64))
+        distances = np.asarray(distances, dtype=np.float64)
+        nSteps = int(np.ceil(distances.max() / self.step)) if distances.size > 0 else 0
+        state = np.array([np.zeros(masses.shape), muzzleVelocities * np.cos(self.angle), muzzleVelocities * np.sin(self.angle)])
+        h = self.step
+        # Linear interpolation between the steps, accumulated while
+        # integrating: only the speed and height at the distances are kept,
+        # not the whole trajectory.
+        position = distances / h
+        lower = np.minimum(np.floor(position).astype(int), max(nSteps - 1, 0))
+        upper = np.minimum(lower + 1, nSteps)
+        weight = position - lower
+        # Distance first, so that every distance is one contiguous block.
+        speedsAt = np.zeros((distances.size,) + masses.shape)
+        heightsAt = np.zeros((distances.size,) + masses.shape) if withHeights else None
+        def record(i_step, speed, height):
+            for j_distance in np.flatnonzero(lower == i_step):
+                speedsAt[j_distance] += speed * (1 - weight[j_distance])
+                if withHeights:
+                    heightsAt[j_distance] += height * (1 - weight[j_distance])
+            for j_distance in np.flatnonzero(upper == i_step):
+                speedsAt[j_distance] += speed * weight[j_distance]
+                if withHeights:
+                    heightsAt[j_distance] += height * weight[j_distance]
+        record(0, muzzleVelocities, np.zeros(masses.shape))
+        with np.errstate(divide="ignore", over="ignore", invalid="ignore"):
+            for i_step in range(1, nSteps + 1):
+                k1 = self._derivatives(masses, state)
+                k2 = self._derivatives(masses, state + 0.5*h*k1)
+                k3 = self._derivatives(masses, state + 0.5*h*k2)
+                k4 = self._derivatives(masses, state + h*k3)
+                state = state + h/6*(k1 + 2*k2 + 2*k3 + k4)
+                # x is the integration variable, it only works while vx > 0.
+                state[:, ~(state[1] > 0)] = np.nan
+                record(i_step, np.sqrt(state[1]*state[1] + state[2]*state[2]), state[0])
+        return np.moveaxis(speedsAt, 0, -1), np.moveaxis(heightsAt, 0, -1) if withHeights else None
+
+    def impactEnergies(self, masses, muzzleVelocities, distances):
+        """The kinetic energies at every distance, see integrate. Unit: J"""
+        speeds, heights = self.integrate(masses, muzzleVelocities, distances)
+        masses = np.broadcast_to(np.asarray(masses, dtype=np.float64), speeds.shape[:-1])[..., np.newaxis]
+        return 0.5 * masses * speeds * speeds
+
+    def dragConstant(self):
+        """
+        The drag constant 0.5*Cd*rho*A of the straight line model with the
+        same constants (Unit: kg/m), stored with the tables of this model.
+        NaN for a velocity dependent Cd, which has no single constant.
+        """
+        if callable(self.dragCoefficient):
+            return np.nan
+        return te.dragConstant(self.dragCoefficient, self.diameter, self.density)
+
+    # ********** Table ********************************************************
+    def _lookupTable(self, masses, distances, maxVelocities):
+        """
+        Speeds at every distance for a grid of muzzle velocities of every mass,
+        as (distance, mass, velocity), with 0 where the BB stalled. The last
+        maxLookupTables are kept for later tables, keyed on the model
+        parameters as well, so changing a parameter does not reuse a table.
+        """
+        key = (self.dragCoefficient, self.diameter, self.density, self.liftCoefficient, self.gravity, self.angle, \
+               self.step, self.velocitySamples, masses.tobytes(), distances.tobytes(), maxVelocities.tobytes())
+        if key in self.lookupTables:
+            self.lookupTables.move_to_end(key)
+            return self.lookupTables[key]
+        fractions = np.linspace(0, 1, self.velocitySamples)[1:]
+        velocities = maxVelocities[:, np.newaxis] * fractions[np.newaxis, :]
+        speeds, heights = self.integrate(masses[:, np.newaxis], velocities, distances, withHeights=False)
+        # (mass, velocity, distance) -> (distance, mass, velocity), which is
+        # the layout integrate computes in, so this is not a copy.
+        speeds = np.moveaxis(speeds, -1, 0)
+        # A BB that stalls before the distance does not reach it: no energy.
+        speeds[np.isnan(speeds)] = 0
+        self.lookupTables[key] = (velocities, speeds)
+        while len(self.lookupTables) > self.maxLookupTables:
+            self.lookupTables.popitem(last=False)
+        return velocities, speeds
+
+    def muzzleVelocityTable(self, masses, distances, energiesMuzzle, energiesImpact):
+        """
+        The table of getTable with this model: the max muzzle velocity such
+        that the energy is at most energiesMuzzle at the muzzle and at most
+        energiesImpact at the safety distance.
+
+        The drag limit is found by inverting a lookup table of the speed at
+        every distance over a grid of muzzle velocities, interpolating the
+        square root of the energy (the speed), which is exactly linear in the
+        muzzle velocity without gravity and lift. The table is inverted one
+        class at a time, classes with the same distance share its row.
+        """
+        masses = np.asarray(masses, dtype=np.float64)
+        distances = np.asarray(distances, dtype=np.float64)
+        velocitiesMuzzle = te.velocityFromEnergy(masses[np.newaxis, :], np.asarray(energiesMuzzle, dtype=np.float64)[:, np.newaxis])
+        # The grid must reach the muzzle limit, beyond which drag does not matter.
+        maxVelocities = np.max(velocitiesMuzzle, axis=0) * 1.001
+        uniqueDistances, rows = np.unique(distances, return_inverse=True)
+        velocities, speeds = self._lookupTable(masses, uniqueDistances, maxVelocities)
+        targets = te.velocityFromEnergy(masses[np.newaxis, :], np.asarray(energiesImpact, dtype=np.float64)[:, np.newaxis])
+        velocitiesDrag = np.empty(targets.shape)
+        for i_class, j_distance in enumerate(rows.reshape(-1).tolist()):
+            # classSpeeds: (mass, velocity), target: (mass,)
+            classSpeeds = speeds[j_distance]
+            target = targets[i_class]
+            # Index of the first grid velocity whose speed exceeds the target.
+            upper = np.sum(classSpeeds <= target[:, np.newaxis], axis=-1)
+            upper = np.clip(upper, 1, velocities.shape[1] - 1)
+            lower = upper - 1
+            speedLower = np.take_along_axis(classSpeeds, lower[:, np.newaxis], axis=-1)[:, 0]
+            speedUpper = np.take_along_axis(classSpeeds, upper[:, np.newaxis], axis=-1)[:, 0]
+            velocityLower = np.take_along_axis(velocities, lower[:, np.newaxis], axis=-1)[:, 0]
+            velocityUpper = np.take_along_axis(velocities, upper[:, np.newaxis], axis=-1)[:, 0]
+            weight = (target - speedLower) / (speedUpper - speedLower)
+            # Above the grid the drag limit is not reached below the muzzle limit.
+            velocitiesDrag[i_class] = np.where(classSpeeds[:, -1] <= target, np.inf, velocityLower + (velocityUpper - velocityLower) * weight)
+        return np.minimum(velocitiesDrag, velocitiesMuzzle)
+
+# ********** Test *************************************************************
+if __name__ == "__main__":
+    import AirsoftSafetyTableGenerator
+    for name in ["vsaf2020", "2020DragCoeff04"]:
+        ruleset = AirsoftSafetyTableGenerator.getRuleset(name)
+        reference = te.computeTable(**ruleset)
+        model = TrajectoryModel(dragCoefficient=ruleset.get("dragCoefficient", 0.477), gravity=0)
+        table = te.computeTable(model=model, **ruleset)
+        # Without gravity the model is the straight line model.
+        assert np.max(np.abs(table.muzzleVelocities - reference.muzzleVelocities)) < 1e-8
+        assert table.constant == reference.constant
+        # With gravity the BB flies a longer path and gets a lower limit.
+        model.gravity = 9.81
+        table = te.computeTable(model=model, **ruleset)
+        assert np.all(table.muzzleVelocities <= reference.muzzleVelocities + 1e-8)
+        assert len(model.lookupTables) <= model.maxLookupTables
+    # Constants that conflict with the model are not ignored.
+    try:
+        te.computeTable(model=TrajectoryModel(), **AirsoftSafetyTableGenerator.getRuleset("2020DragCoeff04"))
+        raise AssertionError("A conflicting drag coefficient was accepted.")
+    except ValueError:
+        pass
+    print("TrajectoryModel ok")